@@ -0,0 +1,49 @@
+"""
+Synthetic versioned APIs for the benchmarks.
+"""
+from typing import List
+
+from fastapi import APIRouter
+from semantic_version import Version
+
+from fastapi_versioned import VersionRouter
+
+
+def _make_endpoint(name: str):
+    def endpoint(item_id: int, q: str = None):
+        return {"item_id": item_id, "q": q}
+
+    endpoint.__name__ = name
+    return endpoint
+
+
+def build_versions(
+    version_count: int, route_count: int, share_routes: bool
+) -> List[VersionRouter]:
+    """
+    Build a chain of versions where each version inherits the routes of the previous one using base= and
+    without(), overriding a single route
+
+    :param version_count: The number of versions, numbered 1.0.0, 1.1.0, ...
+    :param route_count: The number of routes in each version, '/resource_{index}/{item_id}'
+    :param share_routes: Share the inherited routes rather than copying them
+    """
+    router = APIRouter()
+    endpoints = []
+    for index in range(route_count):
+        endpoint = _make_endpoint(f"route_{index}")
+        router.get(f"/resource_{index}/{{item_id}}")(endpoint)
+        endpoints.append(endpoint)
+
+    versions = [VersionRouter(Version("1.0.0"), router, share_routes=share_routes)]
+    for index in range(1, version_count):
+        # Each new version overrides one of the routes of the previous one
+        replaced = endpoints[index % route_count]
+        version = VersionRouter(
+            Version(f"1.{index}.0"), base=versions[-1].without([replaced])
+        )
+        endpoint = _make_endpoint(replaced.__name__)
+        version.router.get(f"/resource_{index % route_count}/{{item_id}}")(endpoint)
+        endpoints[index % route_count] = endpoint
+        versions.append(version)
+    return versions
@@ -0,0 +1,48 @@
+"""
+Memory benchmark comparing copied and shared route inheritance.
+
+Builds a chain of versions where each version inherits from the previous one, overriding a single route, and
+reports the time and memory it takes to construct the FastAPIVersioned app.
+
+    python -m benchmarks.memory --versions 50 --routes 500
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from fastapi_versioned import FastAPIVersioned
+
+from .generator import build_versions
+
+
+def measure(version_count: int, route_count: int, share_routes: bool):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    versions = build_versions(version_count, route_count, share_routes)
+    app = FastAPIVersioned(title="Benchmark", versions=versions)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del app, versions
+    return elapsed, current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--versions", type=int, default=50)
+    parser.add_argument("--routes", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{args.versions} versions x {args.routes} routes")
+    print(f"{'mode':<8} {'time (s)':>10} {'current (MiB)':>14} {'peak (MiB)':>12}")
+    for mode, share_routes in (("copy", False), ("shared", True)):
+        elapsed, current, peak = measure(args.versions, args.routes, share_routes)
+        print(
+            f"{mode:<8} {elapsed:>10.2f} {current / 2 ** 20:>14.1f} {peak / 2 ** 20:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
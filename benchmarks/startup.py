@@ -0,0 +1,38 @@
+"""
+Cold start benchmark comparing eagerly and lazily built version apps.
+
+Only the construction of FastAPIVersioned is timed, the version routers are built beforehand.
+
+    python -m benchmarks.startup --versions 200 --routes 100
+"""
+import argparse
+import time
+
+from fastapi_versioned import FastAPIVersioned
+
+from .generator import build_versions
+
+
+def measure(version_count: int, route_count: int, share_routes: bool, lazy: bool):
+    versions = build_versions(version_count, route_count, share_routes)
+    start = time.perf_counter()
+    FastAPIVersioned(title="Benchmark", versions=versions, lazy_versions=lazy)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--versions", type=int, default=200)
+    parser.add_argument("--routes", type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{args.versions} versions x {args.routes} routes")
+    print(f"{'routes':<8} {'eager (s)':>10} {'lazy (s)':>10}")
+    for mode, share_routes in (("copy", False), ("shared", True)):
+        eager = measure(args.versions, args.routes, share_routes, lazy=False)
+        lazy = measure(args.versions, args.routes, share_routes, lazy=True)
+        print(f"{mode:<8} {eager:>10.3f} {lazy:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
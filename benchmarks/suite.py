@@ -0,0 +1,251 @@
+"""
+Benchmark suite measuring how a versioned app scales with its number of versions and routes.
+
+Measures construction time (eager and lazy), peak memory while constructing, dispatch latency to the first, middle
+and latest versions, /versions throughput and the time taken by get_version_changes(). Results can be written as
+JSON and compared against a previous run, e.g. one made on the main branch, to catch regressions:
+
+    python -m benchmarks.suite --versions 50 --routes 200 --output before.json
+    python -m benchmarks.suite --versions 50 --routes 200 --compare before.json
+"""
+import argparse
+import asyncio
+import gc
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+import fastapi
+
+from fastapi_versioned import FastAPIVersioned
+
+from .generator import build_versions
+
+# Bump when measurements are added, removed or change meaning so old results aren't compared with new ones
+RESULTS_FORMAT = 1
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _timed(function: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def _best_of(repeat: int, function: Callable[[], float]) -> float:
+    # The minimum is the least noisy estimate of what the code itself costs
+    return min(function() for _ in range(repeat))
+
+
+def _http_scope(path: str) -> Dict[str, Any]:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"benchmark")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("benchmark", 80),
+    }
+
+
+def _request_seconds(app: FastAPIVersioned, path: str, requests: int) -> float:
+    """
+    The median time an ASGI request to path takes, calling the app directly so no HTTP client or server is timed
+    """
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def run() -> List[float]:
+        status = []
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+
+        # The first request builds anything done lazily
+        await app(_http_scope(path), receive, send)
+        if status[0] != 200:
+            raise RuntimeError(f"GET {path} returned {status[0]}")
+        timings = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            await app(_http_scope(path), receive, send)
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    loop = asyncio.new_event_loop()
+    try:
+        return statistics.median(loop.run_until_complete(run()))
+    finally:
+        loop.close()
+
+
+def run_suite(
+    version_count: int,
+    route_count: int,
+    share_routes: bool,
+    repeat: int = 3,
+    requests: int = 200,
+) -> Dict[str, float]:
+    """
+    :return: Each measurement by name. Times are in seconds, memory in bytes and throughput in requests per second
+    """
+    results: Dict[str, float] = {}
+
+    def construct(lazy: bool) -> float:
+        versions = build_versions(version_count, route_count, share_routes)
+        start = time.perf_counter()
+        FastAPIVersioned(title="Benchmark", versions=versions, lazy_versions=lazy)
+        return time.perf_counter() - start
+
+    results["construct_routers_seconds"] = _best_of(
+        repeat,
+        lambda: _timed(
+            lambda: build_versions(version_count, route_count, share_routes)
+        ),
+    )
+    results["construct_eager_seconds"] = _best_of(repeat, lambda: construct(False))
+    results["construct_lazy_seconds"] = _best_of(repeat, lambda: construct(True))
+
+    gc.collect()
+    tracemalloc.start()
+    versions = build_versions(version_count, route_count, share_routes)
+    app = FastAPIVersioned(title="Benchmark", versions=versions)
+    results["construct_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # The last route is the worst case of a linear scan over the routes
+    route = f"/resource_{route_count - 1}/1"
+    for name, version in (
+        ("first", versions[0].version),
+        ("middle", versions[len(versions) // 2].version),
+        ("latest", versions[-1].version),
+    ):
+        results[f"dispatch_{name}_seconds"] = _request_seconds(
+            app, f"/v{version}{route}", requests
+        )
+    results["versions_requests_per_second"] = 1 / _request_seconds(
+        app, "/versions", requests
+    )
+
+    results["version_changes_seconds"] = _timed(app.get_version_changes)
+    return results
+
+
+def compare(
+    results: Dict[str, Any], baseline: Dict[str, Any], threshold: float
+) -> List[str]:
+    """
+    Print how results changed from baseline
+
+    :param threshold: The ratio above which a change is a regression, e.g. 1.2 for 20% slower
+    :return: The names of the measurements that regressed
+    """
+    if baseline.get("format") != RESULTS_FORMAT:
+        raise ValueError(
+            "The baseline was made by an incompatible version of the suite"
+        )
+    if baseline["parameters"] != results["parameters"]:
+        raise ValueError(
+            f"The baseline was run with {baseline['parameters']} rather than {results['parameters']}"
+        )
+    regressions = []
+    print(f"{'measurement':<32} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, value in results["results"].items():
+        before = baseline["results"].get(name)
+        if not before:
+            continue
+        # Higher throughput is better, everything else is a cost
+        ratio = before / value if name.endswith("_per_second") else value / before
+        flag = ""
+        if ratio > threshold:
+            regressions.append(name)
+            flag = " REGRESSION"
+        print(f"{name:<32} {before:>12.6g} {value:>12.6g} {ratio:>7.2f}x{flag}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--versions", type=int, default=50)
+    parser.add_argument("--routes", type=int, default=200)
+    parser.add_argument(
+        "--copy-routes",
+        action="store_true",
+        help="Copy inherited routes into each version instead of sharing them",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--requests", type=int, default=200, help="Requests per latency measurement"
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument(
+        "--compare", help="A JSON file from a previous run to compare with"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.2,
+        help="Fail when a measurement is this many times worse than in the baseline",
+    )
+    args = parser.parse_args(argv)
+
+    report = {
+        "format": RESULTS_FORMAT,
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "fastapi": fastapi.__version__,
+        "parameters": {
+            "versions": args.versions,
+            "routes": args.routes,
+            "share_routes": not args.copy_routes,
+            "requests": args.requests,
+        },
+        "results": run_suite(
+            args.versions,
+            args.routes,
+            share_routes=not args.copy_routes,
+            repeat=args.repeat,
+            requests=args.requests,
+        ),
+    }
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.threshold)
+        return 1 if regressions else 0
+
+    for name, value in report["results"].items():
+        print(f"{name:<32} {value:>12.6g}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
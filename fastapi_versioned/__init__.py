@@ -1,3 +1,4 @@
 from .app import FastAPIVersioned, VersionRouter
 from .detection import detect_versions
 from .helpers import get_parent_app
+from .routing import DuplicateRouteError
@@ -1,21 +1,73 @@
-from itertools import chain, groupby
-from typing import Any, Callable, Dict, List, Optional, Tuple, Union
-
-from fastapi import APIRouter, FastAPI
-from fastapi.routing import APIRoute
+import fnmatch
+import inspect
+import json
+import re
+import threading
+import time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from fastapi import APIRouter, FastAPI, HTTPException, Query
 from fastapi.templating import Jinja2Templates
 from openapi_schema_pydantic import OpenAPI
 from pkg_resources import resource_filename
 from pydantic import BaseModel
 from semantic_version import Version
+from starlette.middleware.exceptions import ExceptionMiddleware
 from starlette.requests import Request
-from starlette.responses import HTMLResponse
+from starlette.responses import HTMLResponse, StreamingResponse
+from starlette.routing import BaseRoute
+from starlette.types import ASGIApp
 
-from .changelog import compare_openapi
+from .changelog import APIChangeList, OpenAPIFingerprints, compare_openapi
+from .instrumentation import timed
 from .logger import logger
+from .metrics import MetricsCollector
+from .negotiation import VersionIndex, VersionNegotiator
+from .parallel import build_changes_in_pool
+from .profiling import enable_startup_profiling, profile_phase, take_active_profiler
+from .responses import CachedContent
+from .routing import (
+    DuplicateRouteError,
+    ExcludedRoute,
+    IndexedAPIRouter,
+    RouteExclusion,
+    VersionDispatcher,
+    VersionPipeline,
+    find_duplicate_routes,
+    include_router,
+    share_router,
+)
+
+if TYPE_CHECKING:
+    from .openapi import OpenAPIFragmentCache
 
 __all__ = ["VersionRouter", "FastAPIVersioned"]
 
+# Defaults FastAPI applies to the routes it includes, shared routes aren't included so would silently miss them
+_ROUTE_DEFAULT_KWARGS = (
+    "dependencies",
+    "default_response_class",
+    "responses",
+    "callbacks",
+    "deprecated",
+    "include_in_schema",
+    "generate_unique_id_function",
+)
+_FASTAPI_PARAMETERS = inspect.signature(FastAPI.__init__).parameters
+
+# Bump when the layout of dump_changelog changes so stale artifacts are ignored rather than misread
+CHANGELOG_ARTIFACT_FORMAT = 2
+
 templates = Jinja2Templates(directory=resource_filename(__name__, "resources"))
 
 
@@ -26,18 +78,65 @@ class VersionResponse(BaseModel):
 
 
 class APIChange(BaseModel):
+    path: str
+    method: str
     breaking: bool
+    category: str
+    detail: str
 
 
 class Transition(BaseModel):
     breaking: bool
+    version_previous: Optional[str]
+    version_current: str
     version_previous_href: Optional[str]
     version_current_href: Optional[str]
 
 
+class RouteMetrics(BaseModel):
+    version: str
+    # The path template of the route, None for requests that didn't reach an API route, e.g. 404s
+    route: Optional[str]
+    method: str
+    count: int
+    errors: int
+    total_seconds: float
+    last_request: Optional[float]
+    # Request counts by latency, keyed by the upper bound of each bucket in seconds
+    latency_histogram: Dict[str, int]
+
+
+class VersionMetrics(BaseModel):
+    version: str
+    count: int
+    errors: int
+    last_request: Optional[float]
+
+
+class MetricsResponse(BaseModel):
+    # Every version being served, including those without any requests
+    versions: List[VersionMetrics]
+    routes: List[RouteMetrics]
+
+
+class RouteConflict(BaseModel):
+    version: str
+    path: str
+    method: str
+    routes: List[str]
+
+
 class ChangeResponse(BaseModel):
-    transiton: Transition
-    change: List[APIChange] = []
+    transition: Transition
+    # The number of changes matching the filters, of which changes holds the requested page
+    total: int
+    changes: List[APIChange] = []
+
+
+class ChangelogResponse(BaseModel):
+    # The number of versions, of which versions holds the requested page, newest first
+    total: int
+    versions: List[ChangeResponse] = []
 
 
 class VersionRouter:
@@ -46,39 +145,58 @@ class VersionRouter:
         version: Version,
         router: Optional[APIRouter] = None,
         base: Optional["VersionRouter"] = None,
+        share_routes: Optional[bool] = None,
+        exception_handlers: Optional[Dict[Any, Callable]] = None,
     ):
+        """
+        :param version: The semantic version of this API
+        :param router: The router containing the routes of this version
+        :param base: A previous version to inherit the routes of
+        :param share_routes: Reference the route objects of the base version instead of rebuilding copies of them.
+            Defaults to the setting of the base version. Shared routes are not bound to the version app so its
+            dependency_overrides do not apply to them, and FastAPIVersioned raises ValueError if it is given route
+            defaults such as dependencies or default_response_class that they would miss
+        :param exception_handlers: Exception handlers for this version, keyed by status code or exception class like
+            FastAPI(exception_handlers=...). Added to those of the base version
+        """
         self.router = router or APIRouter()
+        if share_routes is None:
+            share_routes = base.share_routes if base else False
+        self.share_routes = share_routes
+        self.exception_handlers: Dict[Any, Callable] = dict(
+            base.exception_handlers if base else {}
+        )
+        self.exception_handlers.update(exception_handlers or {})
         if base:
-            self.router.include_router(base.router)
+            with profile_phase("inherit_routes", version):
+                if self.share_routes:
+                    share_router(self.router, base.router)
+                else:
+                    self.router.include_router(base.router)
         self.version = version
 
-    def without(self, routes: List[Union[Callable, APIRouter]]):
+    def without(self, routes: List[ExcludedRoute]):
         """
         Given a lits of view function endpoints or APIRoutes return the same version but without these included
 
-        :param routes: A list of view functions (The endpoints of the route), or sub-routers
+        :param routes: A list of view functions (The endpoints of the route), sub-routers (nested routers are
+            included), paths or (method, path) tuples. Paths may be glob patterns like '/items/*'
         :return: The same VersionRouter but with these removed
         """
+        exclude = RouteExclusion(routes)
+
         new_router = APIRouter()
-        new_router.include_router(self.router)
-
-        routes_expanded = []
-        for excluded in routes:
-            # TODO: Does this need to be recursive?
-            if hasattr(excluded, "routes"):
-                for route in excluded.routes:
-                    routes_expanded.append(route.endpoint)
+        with profile_phase("without", self.version):
+            if self.share_routes:
+                share_router(new_router, self.router, exclude=exclude)
             else:
-                routes_expanded.append(excluded)
-        to_exclude = []
-        for excluded_item in self.router.routes:
-            if excluded_item.endpoint in routes_expanded:
-                to_exclude.append(excluded_item)
+                include_router(new_router, self.router, exclude=exclude)
 
-        for excluded in to_exclude:
-            new_router.routes.remove(excluded)
-
-        new_version = VersionRouter(self.version)
+        new_version = VersionRouter(
+            self.version,
+            share_routes=self.share_routes,
+            exception_handlers=self.exception_handlers,
+        )
         new_version.router = new_router
         return new_version
 
@@ -95,126 +213,769 @@ class VersionRouter:
         return f"/changes/{str(self.version)}"
 
     @property
-    def duplicate_routes(self):
+    def duplicate_routes(self) -> Dict[Tuple[str, str], List[BaseRoute]]:
         """
         Try and find routes that are duplicated. This normally means you haven't excluded the old route when
         preparing the new API version if you have modified it
 
-        :return:
+        :return: The duplicated routes keyed by (path, method). Routes whose paths only differ by the names of
+            their path parameters are duplicates
         """
-        # Expand out our routes by method
-        expanded_routes = chain.from_iterable(
-            [((route.path, method), route) for method in route.methods]
-            for route in self.router.routes
-        )
-
-        def sort_key(val: Tuple[Tuple[str, str], APIRoute]):
-            return val[0]
-
-        duplicated_routes = {}
-        for key, routes in groupby(expanded_routes, sort_key):
-            api_routes = [route[1] for route in routes]
-            if len(api_routes) > 1:
-                duplicated_routes[key] = api_routes
-        return duplicated_routes
+        return find_duplicate_routes(self.router.routes)
 
 
 class FastAPIVersioned(FastAPI):
     def __init__(
-        self, versions: List[VersionRouter], versions_path: str = "/versions", **kwargs
+        self,
+        versions: List[VersionRouter],
+        versions_path: str = "/versions",
+        versions_cache_control: Optional[str] = "no-cache",
+        changelog_workers: Optional[int] = None,
+        incremental_openapi: bool = False,
+        changelog_artifact: Optional[str] = None,
+        lazy_versions: bool = False,
+        fatal_duplicate_routes: bool = False,
+        compiled_routes: bool = False,
+        version_negotiation: bool = False,
+        version_header: str = "Accept-Version",
+        streaming_changelog: bool = False,
+        shared_middleware: bool = False,
+        collect_metrics: bool = False,
+        metrics_path: str = "/metrics",
+        max_loaded_versions: Optional[int] = None,
+        version_idle_timeout: Optional[float] = None,
+        profile_startup: bool = False,
+        log_startup_profile: bool = False,
+        **kwargs,
     ):
+        """
+        :param versions: The version routers to serve
+        :param versions_path: The path of the endpoint listing the versions
+        :param versions_cache_control: The Cache-Control header of the version list. It has an ETag so clients can
+            always revalidate it cheaply
+        :param changelog_workers: Build the version diffs up front using this many processes. If not set the diffs
+            are built the first time they are needed
+        :param incremental_openapi: Generate the OpenAPI schema of each version from path items and component
+            schemas cached across versions. Works best with VersionRouter(share_routes=True)
+        :param changelog_artifact: Path to a changelog built ahead of time with 'fastapi-versioned changelog'. The
+            diffs and changelog page are loaded from it so no OpenAPI has to be generated to serve them
+        :param lazy_versions: Only build the app of a version when it is first needed, normally by the first request
+            to it, rather than building them all now
+        :param fatal_duplicate_routes: Raise DuplicateRouteError if a version has duplicate routes rather than
+            logging a warning. With lazy_versions the check happens when the version is built
+        :param compiled_routes: Route the requests of each version through an index of its routes rather than
+            trying every route in order. Worth it for versions with many routes
+        :param version_negotiation: Serve requests without a version in their path from the version asked for by the
+            version header or a vendor media type in Accept (e.g. 'application/vnd.example.v2+json'), or the latest
+            version if they don't ask for one. Routes of this app take priority over those of the versions
+        :param version_header: The header clients can ask for a version with
+        :param streaming_changelog: Stream the changelog page while the versions are compared, newest first, rather
+            than rendering it all before responding. The page is still served whole if it was loaded from an
+            artifact
+        :param shared_middleware: Send requests from this app's middleware straight to the routes of the version
+            apps rather than through a middleware stack per version. Middleware passed in kwargs then runs once per
+            request instead of twice. Exception handlers of a version are applied on top of this app's
+        :param collect_metrics: Count and time the requests to each version and route, see version_metrics()
+        :param metrics_path: The path of the endpoint serving the metrics when they are collected
+        :param max_loaded_versions: Keep at most this many version apps built, dropping the least recently used
+            ones. Dropped versions are rebuilt from their VersionRouter when they are next needed
+        :param version_idle_timeout: Drop the app of a version that hasn't had a request for this many seconds.
+            Either of these options implies lazy_versions
+        :param profile_startup: Measure the time and memory taken by each phase of constructing this app, in total
+            and per version, see startup_profile. To include importing the versions call
+            profiling.enable_startup_profiling() before detect_versions() or set FASTAPI_VERSIONED_PROFILE_STARTUP
+        :param log_startup_profile: Log a summary of the startup profile at INFO level
+        """
         if "version" in kwargs:
             raise ValueError("Don't set the API version this will be handled for you")
-        super().__init__(**kwargs)
-        self._init_kwargs = kwargs
-        self.version = "0.0.0"
-        # Easier to reason with this when we know it is always sorted
-        self._version_routers: List[VersionRouter] = sorted(
-            versions, key=lambda val: val.version
-        )
+        if profile_startup or log_startup_profile:
+            enable_startup_profiling(log_report=log_startup_profile)
+        try:
+            super().__init__(**kwargs)
+            self._init_kwargs = kwargs
+            self.version = "0.0.0"
+            # Easier to reason with this when we know it is always sorted
+            self._version_routers: List[VersionRouter] = sorted(
+                versions, key=lambda val: val.version
+            )
 
-        self._warn_duplicate_paths()
+            self._routers_by_version: Dict[Version, VersionRouter] = {
+                router.version: router for router in self._version_routers
+            }
 
-        self._sub_apps: List[Tuple[Version, FastAPI]] = []
-        for version_router in self._version_routers:
-            self._add_version(version_router)
+            self._max_loaded_versions = max_loaded_versions
+            self._version_idle_timeout = version_idle_timeout
+            self._evict_versions = (
+                max_loaded_versions is not None or version_idle_timeout is not None
+            )
+            # Evicted versions are rebuilt on demand so there's no point building them all up front
+            lazy_versions = lazy_versions or self._evict_versions
+            self._lazy_versions = lazy_versions
+            self._fatal_duplicate_routes = fatal_duplicate_routes
+            self._compiled_routes = compiled_routes
+            self._streaming_changelog = streaming_changelog
+            self._version_pipelines: Dict[Version, VersionPipeline] = {}
+            # Every duplicated (path, method) found so far, in version order unless versions are lazy
+            self.route_conflicts: List[RouteConflict] = []
+            if not lazy_versions:
+                # Lazy versions are checked as they are built so the routes of detected versions aren't loaded early
+                for version_router in self._version_routers:
+                    self._check_duplicate_routes(version_router)
+            self._version_apps: Dict[Version, FastAPI] = {}
+            self._version_apps_lock = threading.Lock()
+            # Only kept when versions are evicted. Written without the lock, a lost update only makes eviction less exact
+            self._version_last_used: Dict[Version, float] = {}
+            self._next_idle_check = 0.0
+            self._checked_versions: Set[Version] = set()
+            # Versions can't change once they are built so the diffs between them and the changelog page are memoized
+            self._version_changes: Dict[Tuple[Version, Version], APIChangeList] = {}
+            self._openapi_documents: Dict[
+                Version, Tuple[OpenAPI, OpenAPIFingerprints]
+            ] = {}
+            self._changelog_page: Optional[CachedContent] = None
+            # The version list only changes when a version is added so it's served as pre-serialized JSON
+            self._versions_cache_control = versions_cache_control
+            self._versions_document: Optional[CachedContent] = None
+            self._openapi_fragments: Optional["OpenAPIFragmentCache"] = None
+            if incremental_openapi:
+                # Imported on demand as it relies on FastAPI internals which newer versions don't have
+                from .openapi import OpenAPIFragmentCache
+
+                self._openapi_fragments = OpenAPIFragmentCache()
+            # All versions share one route so a request costs a dict lookup rather than a scan over a Mount per version
+            negotiator = None
+            if version_negotiation:
+                negotiator = VersionNegotiator(VersionIndex(), header=version_header)
+            self.metrics: Optional[MetricsCollector] = None
+            if collect_metrics:
+                self.metrics = MetricsCollector()
+            self._dispatcher = VersionDispatcher(
+                (
+                    self._get_version_pipeline
+                    if shared_middleware
+                    else self.get_version_app
+                ),
+                negotiator=negotiator,
+                metrics=self.metrics,
+                parent_routes=self.router.routes,
+                get_routes=self._get_version_routes,
+            )
+            self.router.routes.append(self._dispatcher)
+            for version_router in self._version_routers:
+                self._add_version(version_router)
+
+            self.add_api_route(
+                versions_path,
+                self._versions_view,
+                methods=["GET"],
+                response_model=List[VersionResponse],
+            )
+            self.add_api_route(
+                "/changelog",
+                self._changelog_view,
+                methods=["GET"],
+                response_class=HTMLResponse,
+            )
+            if collect_metrics:
+                self.add_api_route(
+                    metrics_path,
+                    self.version_metrics,
+                    methods=["GET"],
+                    response_model=MetricsResponse,
+                )
+            self.add_api_route(
+                "/changes",
+                self._changes_view,
+                methods=["GET"],
+                response_model=ChangelogResponse,
+            )
+            self.add_api_route(
+                "/changes/{version}",
+                self._version_changes_view,
+                methods=["GET"],
+                response_model=ChangeResponse,
+            )
 
-        self.add_api_route(
-            versions_path,
-            self._versions_view,
-            methods=["GET"],
-            response_model=List[VersionResponse],
-        )
-        self.add_api_route(
-            "/changelog",
-            self._changelog_view,
-            methods=["GET"],
-            response_class=HTMLResponse,
+            loaded = False
+            if changelog_artifact:
+                with open(changelog_artifact, encoding="utf-8") as artifact_file:
+                    loaded = self.load_changelog(json.load(artifact_file))
+            if changelog_workers and not loaded:
+                self.build_version_changes(workers=changelog_workers)
+        except BaseException:
+            # Don't leave tracemalloc and the timing hook running, or hand this profile to the next app
+            profiler = take_active_profiler()
+            if profiler is not None:
+                profiler.stop()
+            raise
+
+        # Set when startup was profiled, see StartupProfiler.report() for its layout
+        self.startup_profile: Optional[Dict[str, Any]] = None
+        profiler = take_active_profiler()
+        if profiler is not None:
+            profiler.stop()
+            self.startup_profile = profiler.report()
+            if profiler.log_report or log_startup_profile:
+                profiler.log()
+
+    def _check_duplicate_routes(self, version_router: VersionRouter):
+        with profile_phase("duplicate_check", version_router.version):
+            duplicates = version_router.duplicate_routes
+        conflicts = [
+            RouteConflict(
+                version=str(version_router.version),
+                path=path,
+                method=method,
+                routes=[
+                    getattr(route, "name", None) or repr(route) for route in routes
+                ],
+            )
+            for (path, method), routes in duplicates.items()
+        ]
+        if not conflicts:
+            return
+        self.route_conflicts.extend(conflicts)
+        message = (
+            f"Version router '{version_router.version}' contains duplicate routes for "
+            f"(path, methods)={[(conflict.path, conflict.method) for conflict in conflicts]}. This may indicate "
+            f"you forgot to exclude the old routes in this version using base_router.without()"
         )
-
-    def _warn_duplicate_paths(self):
-        for router in self._version_routers:
-            duplicate_routes = router.duplicate_routes
-            if duplicate_routes:
-                logger.warning(
-                    f"Version router '{router.version}' contains duplicate routes for "
-                    f"(path, methods)=f{list(duplicate_routes.keys())}. This may indicate you forgot "
-                    f"to exclude the old routes in this version using base_router.without()"
-                )
+        if self._fatal_duplicate_routes:
+            raise DuplicateRouteError(message)
+        logger.warning(message)
 
     def _add_version(self, version_router: VersionRouter):
+        if version_router.version not in self._routers_by_version:
+            for index, cur_router in enumerate(self._version_routers):
+                if version_router.version < cur_router.version:
+                    insert_index = index
+                    break
+            else:
+                insert_index = len(self._version_routers)
+            self._version_routers.insert(insert_index, version_router)
+            self._routers_by_version[version_router.version] = version_router
+        self._dispatcher.add_version(version_router.version)
+        if not self._lazy_versions:
+            self.get_version_app(version_router.version)
+        if version_router.version > Version(self.version):
+            self.version = str(version_router.version)
+        self._versions_document = None
+        self.invalidate_version_changes()
+
+    def _build_version_app(self, version_router: VersionRouter) -> FastAPI:
+        # Evicted versions are built again but only need checking once
+        if self._lazy_versions and version_router.version not in self._checked_versions:
+            self._checked_versions.add(version_router.version)
+            self._check_duplicate_routes(version_router)
+        with profile_phase("build_app", version_router.version):
+            return self._create_version_app(version_router)
+
+    def _create_version_app(self, version_router: VersionRouter) -> FastAPI:
         version_app = FastAPI(version=str(version_router.version), **self._init_kwargs)
         version_app.state.parent = self
         version_app.state.semver = version_router.version
-        version_app.include_router(version_router.router)
-        for index, (cur_version, _) in enumerate(self._sub_apps):
-            if version_router.version < cur_version:
-                insert_index = index
-                break
+        for key, handler in version_router.exception_handlers.items():
+            version_app.add_exception_handler(key, handler)
+        if self._openapi_fragments is not None:
+            from .openapi import use_fragment_cache
+
+            use_fragment_cache(version_app, self._openapi_fragments)
+        if version_router.share_routes:
+            self._check_shared_route_defaults(version_router)
+            share_router(version_app.router, version_router.router)
         else:
-            insert_index = len(self._sub_apps)
-        self._sub_apps.insert(insert_index, (version_router.version, version_app))
-        self.mount(version_router.mount_point, version_app)
-        if version_router.version > Version(self.version):
-            self.version = str(version_router.version)
+            version_app.include_router(version_router.router)
+        if self._compiled_routes:
+            version_app.router = IndexedAPIRouter.from_router(version_app.router)
+        return version_app
+
+    def _get_version_routes(self, version: Version) -> List[BaseRoute]:
+        return self._routers_by_version[version].router.routes
+
+    def _check_shared_route_defaults(self, version_router: VersionRouter):
+        route_defaults = [
+            name
+            for name in _ROUTE_DEFAULT_KWARGS
+            if name in self._init_kwargs
+            and self._init_kwargs[name] != _FASTAPI_PARAMETERS[name].default
+        ]
+        if route_defaults:
+            raise ValueError(
+                f"Version router '{version_router.version}' shares its routes so they can't take the app's "
+                f"{route_defaults}. Use VersionRouter(share_routes=False) or set these on the routers instead"
+            )
+
+    def get_version_app(self, version: Version) -> FastAPI:
+        """
+        Get the app serving a version, building it if this is the first time it has been needed
+
+        :param version: The version of the app
+        :return: The app of that version
+        """
+        version_app = self._version_apps.get(version)
+        if self._evict_versions:
+            self._touch_version(version)
+        if version_app is None:
+            # Building doesn't await so within one event loop it can't interleave, the lock covers the threadpool
+            with self._version_apps_lock:
+                version_app = self._version_apps.get(version)
+                if version_app is None:
+                    version_app = self._build_version_app(
+                        self._routers_by_version[version]
+                    )
+                    self._version_apps[version] = version_app
+                    if self._max_loaded_versions is not None:
+                        self._evict_least_recently_used()
+        return version_app
+
+    def _touch_version(self, version: Version):
+        now = time.monotonic()
+        self._version_last_used[version] = now
+        if self._version_idle_timeout is not None and now >= self._next_idle_check:
+            # Sweeping a few times per timeout is enough, it doesn't need to happen on every request
+            self._next_idle_check = now + self._version_idle_timeout / 4
+            with self._version_apps_lock:
+                for loaded_version in list(self._version_apps):
+                    last_used = self._version_last_used.get(loaded_version, 0.0)
+                    if now - last_used > self._version_idle_timeout:
+                        self._evict_version(loaded_version)
+
+    def _evict_least_recently_used(self):
+        # Called with the lock held, straight after a version was built and touched so it isn't the one dropped
+        while len(self._version_apps) > self._max_loaded_versions:
+            oldest = min(
+                self._version_apps,
+                key=lambda loaded: self._version_last_used.get(loaded, 0.0),
+            )
+            self._evict_version(oldest)
+
+    def _evict_version(self, version: Version):
+        """
+        Drop the app of a version with its OpenAPI document. Requests already being handled keep their reference
+        to the app, the next one builds it again
+        """
+        version_app = self._version_apps.pop(version, None)
+        self._version_pipelines.pop(version, None)
+        self._openapi_documents.pop(version, None)
+        if (
+            version_app is not None
+            and self._openapi_fragments is not None
+            and not self._routers_by_version[version].share_routes
+        ):
+            # The app's routes are copies that are rebuilt with it, shared routes are reused by the next build
+            self._openapi_fragments.forget_routes(version_app.routes)
+        logger.debug(f"Evicted the app of version {version}")
+
+    def _get_version_pipeline(self, version: Version) -> VersionPipeline:
+        pipeline = self._version_pipelines.get(version)
+        if self._evict_versions:
+            self._touch_version(version)
+        if pipeline is None:
+            version_app = self.get_version_app(version)
+            handle: ASGIApp = version_app.router
+            # The handlers are resolved once here. Versions without handlers of their own leave errors to the
+            # ExceptionMiddleware of this app, as the version app's would have handled them the same way
+            if version_app.exception_handlers != self.exception_handlers:
+                handle = ExceptionMiddleware(
+                    handle, handlers=version_app.exception_handlers, debug=self.debug
+                )
+            # Building twice in a race is harmless, both pipelines wrap the same app
+            pipeline = self._version_pipelines[version] = VersionPipeline(
+                version_app, handle
+            )
+        return pipeline
 
-    def get_version_changes(self) -> Dict[Tuple[Version, Version], Any]:
-        if len(self._sub_apps) < 2:
+    @property
+    def _sub_apps(self) -> List[Tuple[Version, FastAPI]]:
+        # Sorted by version like the routers, this builds any version apps that haven't been yet
+        return [
+            (router.version, self.get_version_app(router.version))
+            for router in self._version_routers
+        ]
+
+    def invalidate_version_changes(self):
+        """
+        Drop the memoized version diffs and rendered changelog so they are rebuilt on next use. This is called for
+        you when a version is added
+        """
+        self._version_changes = {}
+        self._openapi_documents = {}
+        self._changelog_page = None
+
+    def build_version_changes(self, workers: Optional[int] = None):
+        """
+        Build the OpenAPI schema of every version and the diffs between them now rather than on first use
+
+        :param workers: Use a pool of this many processes. Falls back to building them serially if the pool can't
+            be used on this platform
+        """
+        sub_apps = self._sub_apps
+        if workers and workers > 1 and len(sub_apps) > 1:
+            apps = [app for _, app in sub_apps]
+            try:
+                # The steps run in the workers can't be timed individually as hooks aren't shared with them
+                with timed("pool", versions=len(apps), workers=workers):
+                    schemas, changes = build_changes_in_pool(apps, workers)
+            except Exception:
+                logger.warning(
+                    "Could not build the version changes in a process pool, building them serially",
+                    exc_info=True,
+                )
+            else:
+                for (version, app), schema in zip(sub_apps, schemas):
+                    if not app.openapi_schema:
+                        app.openapi_schema = schema
+                for index, change_list in enumerate(changes):
+                    key = (sub_apps[index + 1][0], sub_apps[index][0])
+                    self._version_changes.setdefault(key, change_list)
+        self.get_version_changes()
+
+    def get_version_changes(self) -> Dict[Tuple[Version, Version], APIChangeList]:
+        if len(self._version_routers) < 2:
             return {}
-        changes: Dict[Tuple[Version, Version], Any] = {}
-        # self._routers is always sorted by version
-        for index in range(0, len(self._sub_apps) - 1):
-            old_version, old_app = self._sub_apps[index]
-            new_version, new_app = self._sub_apps[index + 1]
-            new_openapi = OpenAPI.parse_obj(new_app.openapi())
-            old_openapi = OpenAPI.parse_obj(old_app.openapi())
-            changes[(new_version, old_version)] = compare_openapi(
-                new_openapi, old_openapi
+        changes: Dict[Tuple[Version, Version], APIChangeList] = {}
+        # self._version_routers is always sorted by version
+        for index in range(0, len(self._version_routers) - 1):
+            old_version = self._version_routers[index].version
+            new_version = self._version_routers[index + 1].version
+            changes[(new_version, old_version)] = self._get_changes_between(
+                new_version, old_version
             )
 
         return changes
 
-    def _versions_view(self):
-        versions: List[VersionResponse] = []
-        for version in self._version_routers:
-            versions.append(
+    def _get_changes_between(
+        self, new_version: Version, old_version: Version
+    ) -> APIChangeList:
+        key = (new_version, old_version)
+        if key not in self._version_changes:
+            self._version_changes[key] = self._compare_documents(
+                new_version,
+                old_version,
+                self._get_openapi_document(new_version),
+                self._get_openapi_document(old_version),
+            )
+        return self._version_changes[key]
+
+    @staticmethod
+    def _compare_documents(
+        new_version: Version,
+        old_version: Version,
+        new_document: Tuple[OpenAPI, OpenAPIFingerprints],
+        old_document: Tuple[OpenAPI, OpenAPIFingerprints],
+    ) -> APIChangeList:
+        new_openapi, new_fingerprints = new_document
+        old_openapi, old_fingerprints = old_document
+        with timed("diff", version=str(new_version), previous_version=str(old_version)):
+            return compare_openapi(
+                new_openapi, old_openapi, new_fingerprints, old_fingerprints
+            )
+
+    def get_changes(self, version: Version) -> Optional[APIChangeList]:
+        """
+        :param version: A version being served
+        :return: The changes from the version before it, or None for the first version
+        """
+        index = self._version_routers.index(self._routers_by_version[version])
+        if index == 0:
+            return None
+        return self._get_changes_between(
+            version, self._version_routers[index - 1].version
+        )
+
+    def _load_openapi_document(
+        self, version: Version, keep_schema: bool = True
+    ) -> Tuple[OpenAPI, OpenAPIFingerprints]:
+        """
+        :param keep_schema: Leave the schema cached on the version app by app.openapi(). If False it's only kept
+            if it was already cached
+        """
+        document = self._openapi_documents.get(version)
+        if document is None:
+            app = self.get_version_app(version)
+            cached = app.openapi_schema is not None
+            with timed("openapi", version=str(version)):
+                schema = app.openapi()
+            with timed("parse", version=str(version)):
+                document = (OpenAPI.parse_obj(schema), OpenAPIFingerprints(schema))
+            if not keep_schema and not cached:
+                app.openapi_schema = None
+        return document
+
+    def _get_openapi_document(
+        self, version: Version
+    ) -> Tuple[OpenAPI, OpenAPIFingerprints]:
+        # Most versions are part of two comparisons so they are only parsed and fingerprinted once
+        if version not in self._openapi_documents:
+            self._openapi_documents[version] = self._load_openapi_document(version)
+        return self._openapi_documents[version]
+
+    def _iter_changelog_entries(
+        self,
+    ) -> Iterator[Tuple[VersionRouter, Optional[APIChangeList]]]:
+        """
+        Yield each version with the changes from the version before it, newest first, diffing the versions as they
+        are reached. Only the OpenAPI documents of the pair being compared are held rather than those of every
+        version, including the schemas app.openapi() would cache on the version apps. The version apps themselves
+        are still built and kept as usual, use max_loaded_versions to bound them
+        """
+        version_routers = list(self._version_routers)
+        newer_document = None
+        for index in range(len(version_routers) - 1, 0, -1):
+            version_router = version_routers[index]
+            old_version = version_routers[index - 1].version
+            key = (version_router.version, old_version)
+            change_list = self._version_changes.get(key)
+            if change_list is None:
+                if newer_document is None:
+                    newer_document = self._load_openapi_document(
+                        version_router.version, keep_schema=False
+                    )
+                new_document = newer_document
+                # The older document is the newer one of the next pair
+                newer_document = self._load_openapi_document(
+                    old_version, keep_schema=False
+                )
+                change_list = self._compare_documents(
+                    version_router.version, old_version, new_document, newer_document
+                )
+                self._version_changes[key] = change_list
+            else:
+                newer_document = None
+            yield version_router, change_list
+        if version_routers:
+            yield version_routers[0], None
+
+    def dump_changelog(self) -> Dict[str, Any]:
+        """
+        Build the version diffs and changelog page in a form that can be saved as JSON and passed to load_changelog
+
+        :return: The changelog artifact
+        """
+        changes = self.get_version_changes()
+        return {
+            "format": CHANGELOG_ARTIFACT_FORMAT,
+            "versions": [str(router.version) for router in self._version_routers],
+            "changes": [
+                {
+                    "version": str(new_version),
+                    "previous_version": str(old_version),
+                    "changes": change_list.to_rows(),
+                }
+                for (new_version, old_version), change_list in changes.items()
+            ],
+            "html": self._get_changelog_page().body.decode("utf-8"),
+        }
+
+    def load_changelog(self, artifact: Dict[str, Any]) -> bool:
+        """
+        Use the version diffs and changelog page from an artifact made by dump_changelog instead of building them
+
+        :param artifact: The changelog artifact
+        :return: If the artifact was loaded. It is ignored if it was built for a different set of versions
+        """
+        versions = [str(router.version) for router in self._version_routers]
+        if artifact.get("format") != CHANGELOG_ARTIFACT_FORMAT:
+            logger.warning(
+                f"Ignoring changelog artifact with unsupported format {artifact.get('format')!r}"
+            )
+            return False
+        if artifact.get("versions") != versions:
+            logger.warning(
+                f"Ignoring changelog artifact built for versions {artifact.get('versions')} as this app has "
+                f"versions {versions}"
+            )
+            return False
+        self.invalidate_version_changes()
+        for entry in artifact["changes"]:
+            key = (Version(entry["version"]), Version(entry["previous_version"]))
+            self._version_changes[key] = APIChangeList.from_rows(entry["changes"])
+        self._changelog_page = CachedContent(
+            artifact["html"].encode("utf-8"), "text/html"
+        )
+        return True
+
+    def version_metrics(self) -> MetricsResponse:
+        """
+        The requests each version and route have served since the app started, with collect_metrics=True
+
+        :return: The totals of each version, oldest first, and of each route, busiest first
+        """
+        if self.metrics is None:
+            raise RuntimeError("Metrics are only collected with collect_metrics=True")
+        buckets = [str(bound) for bound in self.metrics.buckets] + ["+Inf"]
+        versions = {
+            str(router.version): VersionMetrics(
+                version=str(router.version), count=0, errors=0, last_request=None
+            )
+            for router in self._version_routers
+        }
+        routes = []
+        for (version, route, method), totals in self.metrics.snapshot().items():
+            routes.append(
+                RouteMetrics(
+                    version=version,
+                    route=route,
+                    method=method,
+                    count=totals["count"],
+                    errors=totals["errors"],
+                    total_seconds=totals["total_seconds"],
+                    last_request=totals["last_request"],
+                    latency_histogram=dict(zip(buckets, totals["buckets"])),
+                )
+            )
+            version_totals = versions.get(version)
+            if version_totals is not None:
+                version_totals.count += totals["count"]
+                version_totals.errors += totals["errors"]
+                version_totals.last_request = max(
+                    version_totals.last_request or 0.0, totals["last_request"]
+                )
+        routes.sort(key=lambda route_metrics: route_metrics.count, reverse=True)
+        return MetricsResponse(versions=list(versions.values()), routes=routes)
+
+    def _get_versions_document(self) -> CachedContent:
+        versions_document = self._versions_document
+        if versions_document is None:
+            versions = [
                 VersionResponse(
                     version=str(version.version),
                     href=version.mount_point + "/",
                     changes_href=version.changes_href,
-                )
+                ).dict()
+                for version in self._version_routers
+            ]
+            # Serialized the same way as FastAPI's JSONResponse
+            body = json.dumps(versions, ensure_ascii=False, separators=(",", ":"))
+            versions_document = self._versions_document = CachedContent(
+                body.encode("utf-8"),
+                "application/json",
+                cache_control=self._versions_cache_control,
             )
-        return versions
+        return versions_document
+
+    def _versions_view(self, request: Request):
+        # Returning a response skips the response_model validation, the model is still used for the docs
+        return self._get_versions_document().response(request)
+
+    def _get_changelog_page(self) -> CachedContent:
+        if self._changelog_page is None:
+            changes = {
+                key[0]: value for key, value in self.get_version_changes().items()
+            }
+            versions = list(reversed(self._version_routers))
+            with timed("render", versions=len(versions)):
+                html = templates.get_template("changelog.html").render(
+                    title=self.title,
+                    versions=versions,
+                    entries=[
+                        (version_router, changes.get(version_router.version))
+                        for version_router in versions
+                    ],
+                )
+            self._changelog_page = CachedContent(html.encode("utf-8"), "text/html")
+        return self._changelog_page
 
-    def _changelog_view(self, request: Request):
-        changes = {key[0]: value for key, value in self.get_version_changes().items()}
-        print(changes)
-        return templates.TemplateResponse(
-            "changelog.html",
-            {
-                "request": request,
-                "title": self.title,
-                "versions": list(reversed(self._version_routers)),
-                "changes": changes,
-            },
+    def _get_change_response(
+        self,
+        index: int,
+        breaking: Optional[bool] = None,
+        path: Optional[str] = None,
+        method: Optional[str] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> ChangeResponse:
+        version_router = self._version_routers[index]
+        previous_router = self._version_routers[index - 1] if index > 0 else None
+        change_list = self.get_changes(version_router.version)
+        changes = change_list.changes if change_list is not None else []
+        if breaking is not None or path or method:
+            path_regex = re.compile(fnmatch.translate(path)) if path else None
+            method = method.upper() if method else None
+            changes = [
+                change
+                for change in changes
+                if (breaking is None or change.breaking == breaking)
+                and (path_regex is None or path_regex.match(change.path))
+                and (method is None or change.method.upper() == method)
+            ]
+        end = offset + limit if limit is not None else None
+        return ChangeResponse(
+            transition=Transition(
+                breaking=bool(change_list and change_list.breaking_count),
+                version_previous=(
+                    str(previous_router.version) if previous_router else None
+                ),
+                version_current=str(version_router.version),
+                version_previous_href=(
+                    previous_router.mount_point + "/" if previous_router else None
+                ),
+                version_current_href=version_router.mount_point + "/",
+            ),
+            total=len(changes),
+            changes=[
+                APIChange(
+                    path=change.path,
+                    method=change.method,
+                    breaking=change.breaking,
+                    category=change.category.name.lower(),
+                    detail=change.detail,
+                )
+                for change in changes[offset:end]
+            ],
+        )
+
+    def _version_changes_view(
+        self,
+        version: str,
+        breaking: Optional[bool] = None,
+        path: Optional[str] = Query(
+            None, description="Only changes to matching paths, may be a glob pattern"
+        ),
+        method: Optional[str] = None,
+        offset: int = Query(0, ge=0),
+        limit: int = Query(100, ge=1, le=1000),
+    ):
+        # Accepts anything a version can be requested with in a path e.g. '1.2.0', '1' or 'latest'
+        resolved = self._dispatcher.index.resolve(version)
+        if resolved is None:
+            raise HTTPException(status_code=404, detail=f"Unknown version '{version}'")
+        index = self._version_routers.index(self._routers_by_version[resolved])
+        return self._get_change_response(
+            index, breaking, path, method, offset=offset, limit=limit
         )
+
+    def _changes_view(
+        self,
+        breaking: Optional[bool] = None,
+        path: Optional[str] = Query(
+            None, description="Only changes to matching paths, may be a glob pattern"
+        ),
+        method: Optional[str] = None,
+        offset: int = Query(0, ge=0),
+        limit: int = Query(10, ge=1, le=100),
+    ):
+        # Paginated by version, newest first. Only the versions on the page are compared
+        count = len(self._version_routers)
+        indices = range(count - 1 - offset, max(count - 1 - offset - limit, -1), -1)
+        return ChangelogResponse(
+            total=count,
+            versions=[
+                self._get_change_response(index, breaking, path, method)
+                for index in indices
+            ],
+        )
+
+    def _changelog_view(self, request: Request):
+        if self._streaming_changelog and self._changelog_page is None:
+            # Rendered as the diffs are made so the first versions are sent before the older ones are compared.
+            # Runs in a thread pool as StreamingResponse iterates synchronous generators there
+            return StreamingResponse(
+                templates.get_template("changelog.html").generate(
+                    title=self.title,
+                    versions=list(reversed(self._version_routers)),
+                    entries=self._iter_changelog_entries(),
+                ),
+                media_type="text/html",
+            )
+        return self._get_changelog_page().response(request)
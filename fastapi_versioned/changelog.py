@@ -1,8 +1,17 @@
+import hashlib
+import json
+from collections import defaultdict
 from enum import Enum
-from typing import Any, Dict, List, Set, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
-from openapi_schema_pydantic import OpenAPI, Operation, PathItem
-from pydantic import BaseModel
+from openapi_schema_pydantic import (
+    MediaType,
+    OpenAPI,
+    Operation,
+    PathItem,
+    Reference,
+    Schema,
+)
 
 # List of method attributes for openapi_schema_pydantic
 _http_methods = {"get", "head", "post", "put", "delete", "options", "trace", "patch"}
@@ -14,29 +23,118 @@ class ChangeCategory(Enum):
     CHANGE = 3
 
 
-class APIChange(BaseModel):
-    path: str
-    method: str
+class APIChange:
+    """
+    A single change between two versions of an API.
+
+    Big diffs hold a lot of these so they are plain slotted records rather than pydantic models. The app converts
+    them to its response models when they are served
+    """
+
+    __slots__ = ("path", "method", "breaking", "category", "detail")
+
+    def __init__(
+        self,
+        path: str,
+        method: str,
+        breaking: bool,
+        category: ChangeCategory,
+        detail: str,
+    ):
+        self.path = path
+        self.method = method
+        self.breaking = breaking
+        self.category = category
+        self.detail = detail
+
+    def to_row(self) -> List[Any]:
+        """
+        :return: The change as a JSON serialisable list, see from_row
+        """
+        return [self.path, self.method, self.breaking, self.category.value, self.detail]
+
+    @classmethod
+    def from_row(cls, row: List[Any]) -> "APIChange":
+        path, method, breaking, category, detail = row
+        return cls(path, method, breaking, ChangeCategory(category), detail)
+
+    def _key(self) -> Tuple[str, str, bool, ChangeCategory, str]:
+        return self.path, self.method, self.breaking, self.category, self.detail
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, APIChange):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(path={self.path!r}, method={self.method!r}, breaking={self.breaking!r}, "
+            f"category={self.category!r}, detail={self.detail!r})"
+        )
 
-    breaking: bool
-    category: ChangeCategory
-    detail: str
 
+class APIChangeList:
+    """
+    The changes between two versions of an API. The counts are worked out once as the changes can't be modified
+    """
 
-class APIChangeList(BaseModel):
-    changes: List[APIChange]
+    __slots__ = ("changes", "breaking_count", "_counts")
 
-    @property
-    def breaking_count(self):
-        return sum(1 for _ in filter(lambda val: val.breaking, self.changes))
+    def __init__(self, changes: Iterable[APIChange] = ()):
+        self.changes: Tuple[APIChange, ...] = tuple(changes)
+        counts: Dict[Tuple[ChangeCategory, bool], int] = defaultdict(int)
+        for change in self.changes:
+            counts[(change.category, change.breaking)] += 1
+        self._counts = dict(counts)
+        self.breaking_count = sum(
+            count for (_, breaking), count in self._counts.items() if breaking
+        )
 
     @property
-    def change_count(self):
+    def change_count(self) -> int:
         return len(self.changes)
 
-    def __len__(self):
+    def count(
+        self,
+        category: Optional[ChangeCategory] = None,
+        breaking: Optional[bool] = None,
+    ) -> int:
+        """
+        :param category: Only count changes of this category
+        :param breaking: Only count breaking (True) or non breaking (False) changes
+        :return: The number of matching changes
+        """
+        return sum(
+            count
+            for (change_category, change_breaking), count in self._counts.items()
+            if (category is None or change_category == category)
+            and (breaking is None or change_breaking == breaking)
+        )
+
+    def to_rows(self) -> List[List[Any]]:
+        return [change.to_row() for change in self.changes]
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[List[Any]]) -> "APIChangeList":
+        return cls(APIChange.from_row(row) for row in rows)
+
+    def __iter__(self) -> Iterator[APIChange]:
+        return iter(self.changes)
+
+    def __len__(self) -> int:
         return len(self.changes)
 
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, APIChangeList):
+            return NotImplemented
+        return self.changes == other.changes
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(changes={list(self.changes)!r})"
+
 
 class PathItemChange(PathItem):
     _changes: List[APIChange]
@@ -47,6 +145,99 @@ class OpenAPIChange(OpenAPI):
     paths: Dict[str, PathItemChange]
 
 
+def _fingerprint(value: Any) -> str:
+    serialised = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(serialised.encode("utf-8")).hexdigest()
+
+
+def _collect_refs(value: Any) -> Set[str]:
+    refs = set()
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            ref = item.get("$ref")
+            if isinstance(ref, str):
+                refs.add(ref)
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+    return refs
+
+
+class OpenAPIFingerprints:
+    """
+    Content hashes of the path items, operations and components of an OpenAPI document along with the '$ref's each
+    of them uses.
+
+    Comparing two documents can then skip any path item that hashes the same in both and doesn't reference a
+    component that changed, so the work done is proportional to what changed rather than the size of the API.
+    Build it once per document and reuse it for every comparison that document is part of.
+    """
+
+    def __init__(self, schema: Dict[str, Any]):
+        """
+        :param schema: The OpenAPI document as a dict, e.g. the output of FastAPI.openapi()
+        """
+        self._paths: Dict[str, Dict[str, Any]] = schema.get("paths") or {}
+        self.paths: Dict[str, str] = {}
+        self.path_refs: Dict[str, Set[str]] = {}
+        for path, item in self._paths.items():
+            self.paths[path] = _fingerprint(item)
+            self.path_refs[path] = _collect_refs(item)
+
+        self.components: Dict[str, str] = {}
+        self.component_refs: Dict[str, Set[str]] = {}
+        for section, entries in (schema.get("components") or {}).items():
+            for name, entry in (entries or {}).items():
+                ref = f"#/components/{section}/{name}"
+                self.components[ref] = _fingerprint(entry)
+                self.component_refs[ref] = _collect_refs(entry)
+
+        # Operations are only hashed when the path item they are part of has changed
+        self._operations: Dict[Tuple[str, str], Tuple[str, Set[str]]] = {}
+
+    @classmethod
+    def from_openapi(cls, document: OpenAPI) -> "OpenAPIFingerprints":
+        return cls(document.dict(by_alias=True, exclude_none=True))
+
+    def operation(self, path: str, method: str) -> Tuple[str, Set[str]]:
+        """
+        :return: The hash of the operation and the refs it uses
+        """
+        key = (path, method)
+        if key not in self._operations:
+            operation = self._paths.get(path, {}).get(method)
+            self._operations[key] = (_fingerprint(operation), _collect_refs(operation))
+        return self._operations[key]
+
+
+def _get_changed_refs(new: OpenAPIFingerprints, old: OpenAPIFingerprints) -> Set[str]:
+    """
+    Find the components that differ between two documents, including those that only changed through another
+    component they reference
+    """
+    changed = set(
+        ref
+        for ref in set(new.components).union(old.components)
+        if new.components.get(ref) != old.components.get(ref)
+    )
+    if not changed:
+        return changed
+    referrers: Dict[str, Set[str]] = defaultdict(set)
+    for fingerprints in (new, old):
+        for ref, targets in fingerprints.component_refs.items():
+            for target in targets:
+                referrers[target].add(ref)
+    stack = list(changed)
+    while stack:
+        for referrer in referrers.get(stack.pop(), ()):
+            if referrer not in changed:
+                changed.add(referrer)
+                stack.append(referrer)
+    return changed
+
+
 def _get_added_removed_remain(
     new: Dict[Any, Any], old: Dict[Any, Any], include_none: bool = False
 ) -> Tuple[Set, Set, Set]:
@@ -70,8 +261,120 @@ def _extract_path_operations(path: PathItem) -> Dict[str, Operation]:
     return operations
 
 
-def compare_openapi(new: OpenAPI, old: OpenAPI) -> APIChangeList:
+class _Direction(Enum):
+    # Data sent by the client, it is breaking to start requiring or rejecting something
+    REQUEST = 1
+    # Data sent by the server, it is breaking to stop sending something or to send something new
+    RESPONSE = 2
+
+
+# (breaking, category, field location, message)
+_SchemaChange = Tuple[bool, ChangeCategory, str, str]
+
+
+def _join_location(parent: str, child: str) -> str:
+    if not parent:
+        return child
+    if not child:
+        return parent
+    if child.startswith("["):
+        return parent + child
+    return f"{parent}.{child}"
+
+
+def _describe(subject: str, location: str, message: str) -> str:
+    if location:
+        return f"{subject} field '{location}' {message}"
+    return f"{subject} {message}"
+
+
+class _DiffContext:
+    """
+    Everything shared while comparing one pair of documents. Comparisons of '$ref'd components are memoized here so
+    each component is only compared once however many operations use it
+    """
+
+    def __init__(
+        self,
+        new: OpenAPI,
+        old: OpenAPI,
+        new_fingerprints: OpenAPIFingerprints,
+        old_fingerprints: OpenAPIFingerprints,
+    ):
+        self.new = new
+        self.old = old
+        self.new_fingerprints = new_fingerprints
+        self.old_fingerprints = old_fingerprints
+        self.changed_refs = _get_changed_refs(new_fingerprints, old_fingerprints)
+        self._component_changes: Dict[
+            Tuple[str, str, _Direction], List[_SchemaChange]
+        ] = {}
+
+    def operation_unchanged(self, path: str, method: str) -> bool:
+        new_hash, refs = self.new_fingerprints.operation(path, method)
+        old_hash, _ = self.old_fingerprints.operation(path, method)
+        return new_hash == old_hash and not refs & self.changed_refs
+
+    @staticmethod
+    def _resolve(document: OpenAPI, value: Any) -> Any:
+        # Follow '$ref's to the components they point at, anything unresolvable is treated as missing
+        seen = set()
+        while isinstance(value, Reference):
+            if value.ref in seen or not value.ref.startswith("#/components/"):
+                return None
+            seen.add(value.ref)
+            _, _, section, name = value.ref.split("/", 3)
+            entries = getattr(document.components, section, None) or {}
+            value = entries.get(name)
+        return value
+
+    def resolve_new(self, value: Any) -> Any:
+        return self._resolve(self.new, value)
+
+    def resolve_old(self, value: Any) -> Any:
+        return self._resolve(self.old, value)
+
+    def compare_schemas(
+        self, new: Any, old: Any, direction: _Direction
+    ) -> List[_SchemaChange]:
+        if isinstance(new, Reference) and isinstance(old, Reference):
+            if new.ref == old.ref and new.ref not in self.changed_refs:
+                return []
+            key = (new.ref, old.ref, direction)
+            if key not in self._component_changes:
+                # Recursive schemas will find this placeholder rather than looping forever
+                self._component_changes[key] = []
+                self._component_changes[key] = _get_schema_changes(
+                    self.resolve_new(new), self.resolve_old(old), direction, self
+                )
+            return self._component_changes[key]
+        return _get_schema_changes(
+            self.resolve_new(new), self.resolve_old(old), direction, self
+        )
+
+
+def compare_openapi(
+    new: OpenAPI,
+    old: OpenAPI,
+    new_fingerprints: Optional[OpenAPIFingerprints] = None,
+    old_fingerprints: Optional[OpenAPIFingerprints] = None,
+) -> APIChangeList:
+    """
+    Find the changes between two versions of an API
+
+    :param new: The newer document
+    :param old: The older document
+    :param new_fingerprints: Fingerprints of the newer document if they have already been built
+    :param old_fingerprints: Fingerprints of the older document if they have already been built
+    :return: The changes going from old to new
+    """
     api_changes: List[APIChange] = []
+    context = _DiffContext(
+        new,
+        old,
+        new_fingerprints or OpenAPIFingerprints.from_openapi(new),
+        old_fingerprints or OpenAPIFingerprints.from_openapi(old),
+    )
 
     added_paths, removed_paths, remain_paths = _get_added_removed_remain(
         new.paths, old.paths
@@ -105,16 +408,21 @@ def compare_openapi(new: OpenAPI, old: OpenAPI) -> APIChangeList:
                 )
                 api_changes.append(change)
 
+    new_fingerprints = context.new_fingerprints
+    old_fingerprints = context.old_fingerprints
     for path in remain_paths:
+        # Identical path items that don't use a changed component can't contain any changes
+        same_hash = new_fingerprints.paths[path] == old_fingerprints.paths[path]
+        if same_hash and not new_fingerprints.path_refs[path] & context.changed_refs:
+            continue
         new_path = new.paths[path]
         old_path = old.paths[path]
-        api_changes.extend(_get_path_changes(path, new_path, old_path))
-    print("API_CHANGES", api_changes)
-    return APIChangeList(changes=api_changes)
+        api_changes.extend(_get_path_changes(path, new_path, old_path, context))
+    return APIChangeList(api_changes)
 
 
 def _get_path_changes(
-    path: str, new_item: PathItem, old_item: PathItem
+    path: str, new_item: PathItem, old_item: PathItem, context: _DiffContext
 ) -> List[APIChange]:
     api_changes = []
     new_operations = _extract_path_operations(new_item)
@@ -143,20 +451,48 @@ def _get_path_changes(
         )
         api_changes.append(change)
 
-    # # If the path operation is still there we need to check the parameters and body to see if anything has changed
-    # for method in remain_operations:
-    #     new_operation = new_operations[method]
-    #     old_operation = old_operations[method]
-    #     api_changes.extend(_get_operation_changes(new_operation, old_operation))
+    # If the path operation is still there we need to check the parameters and body to see if anything has changed
+    for method in remain_operations:
+        if context.operation_unchanged(path, method):
+            continue
+        new_operation = new_operations[method]
+        old_operation = old_operations[method]
+        api_changes.extend(
+            _get_operation_changes(path, method, new_operation, old_operation, context)
+        )
     return api_changes
 
 
 def _get_operation_changes(
-    new_operation: Operation, old_operation: Operation
+    path: str,
+    method: str,
+    new_operation: Operation,
+    old_operation: Operation,
+    context: _DiffContext,
 ) -> List[APIChange]:
     api_changes = []
-    new_parameters = {elem.name: elem for elem in new_operation.parameters or []}
-    old_parameters = {elem.name: elem for elem in old_operation.parameters or []}
+
+    def add_change(breaking: bool, category: ChangeCategory, detail: str):
+        api_changes.append(
+            APIChange(
+                path=path,
+                method=method,
+                breaking=breaking,
+                category=category,
+                detail=detail,
+            )
+        )
+
+    new_parameters = {}
+    for elem in new_operation.parameters or []:
+        param = context.resolve_new(elem)
+        if param is not None:
+            new_parameters[param.name] = param
+    old_parameters = {}
+    for elem in old_operation.parameters or []:
+        param = context.resolve_old(elem)
+        if param is not None:
+            old_parameters[param.name] = param
 
     added_param, removed_param, remain_param = _get_added_removed_remain(
         new_parameters, old_parameters
@@ -165,39 +501,262 @@ def _get_operation_changes(
     for param_name in added_param:
         param = new_parameters[param_name]
         if param.required:
-            change = APIChange(
-                breaking=True,
-                category=ChangeCategory.ADDED,
-                detail=f"Required parameter '{param_name}' has been added",
+            add_change(
+                True,
+                ChangeCategory.ADDED,
+                f"Required parameter '{param_name}' has been added",
             )
-            api_changes.append(change)
         else:
-            change = APIChange(
-                breaking=False,
-                category=ChangeCategory.ADDED,
-                detail=f"Optional parameter '{param_name}' has been added",
+            add_change(
+                False,
+                ChangeCategory.ADDED,
+                f"Optional parameter '{param_name}' has been added",
             )
-            api_changes.append(change)
 
     for param_name in removed_param:
-        change = APIChange(
-            breaking=True,
-            category=ChangeCategory.REMOVED,
-            detail=f"Parameter '{param_name}' has been removed",
+        add_change(
+            True, ChangeCategory.REMOVED, f"Parameter '{param_name}' has been removed"
         )
-        api_changes.append(change)
 
     for param_name in remain_param:
         new_param = new_parameters[param_name]
         old_param = old_parameters[param_name]
         if new_param.param_in != old_param.param_in:
-            change = APIChange(
-                breaking=True,
-                category=ChangeCategory.CHANGE,
-                detail=f"The parameter '{param_name}' has moved from '{old_param.param_in}' to "
+            add_change(
+                True,
+                ChangeCategory.CHANGE,
+                f"The parameter '{param_name}' has moved from '{old_param.param_in}' to "
                 f"'{new_param.param_in}'",
             )
-            api_changes.append(change)
-        # We could go further here and inspect the schema of the parameter for changes but lets stop for now
+        if new_param.required and not old_param.required:
+            add_change(
+                True,
+                ChangeCategory.CHANGE,
+                f"Parameter '{param_name}' is now required",
+            )
+        elif old_param.required and not new_param.required:
+            add_change(
+                False,
+                ChangeCategory.CHANGE,
+                f"Parameter '{param_name}' is no longer required",
+            )
+        for breaking, category, location, message in context.compare_schemas(
+            new_param.param_schema, old_param.param_schema, _Direction.REQUEST
+        ):
+            add_change(
+                breaking,
+                category,
+                _describe(f"Parameter '{param_name}'", location, message),
+            )
+
+    new_body = context.resolve_new(new_operation.requestBody)
+    old_body = context.resolve_old(old_operation.requestBody)
+    if new_body is not None and old_body is None:
+        add_change(
+            new_body.required,
+            ChangeCategory.ADDED,
+            f"{'Required' if new_body.required else 'Optional'} request body has been added",
+        )
+    elif old_body is not None and new_body is None:
+        add_change(True, ChangeCategory.REMOVED, "Request body has been removed")
+    elif new_body is not None and old_body is not None:
+        if new_body.required and not old_body.required:
+            add_change(True, ChangeCategory.CHANGE, "Request body is now required")
+        elif old_body.required and not new_body.required:
+            add_change(
+                False, ChangeCategory.CHANGE, "Request body is no longer required"
+            )
+        for breaking, category, detail in _get_content_changes(
+            "Request body",
+            new_body.content,
+            old_body.content,
+            _Direction.REQUEST,
+            context,
+        ):
+            add_change(breaking, category, detail)
+
+    new_responses = {
+        code: context.resolve_new(response)
+        for code, response in (new_operation.responses or {}).items()
+    }
+    old_responses = {
+        code: context.resolve_old(response)
+        for code, response in (old_operation.responses or {}).items()
+    }
+    added_codes, removed_codes, remain_codes = _get_added_removed_remain(
+        new_responses, old_responses
+    )
+    for code in sorted(removed_codes):
+        add_change(True, ChangeCategory.REMOVED, f"Response {code} has been removed")
+    for code in sorted(added_codes):
+        add_change(False, ChangeCategory.ADDED, f"Response {code} has been added")
+    for code in sorted(remain_codes):
+        for breaking, category, detail in _get_content_changes(
+            f"Response {code}",
+            getattr(new_responses[code], "content", None),
+            getattr(old_responses[code], "content", None),
+            _Direction.RESPONSE,
+            context,
+        ):
+            add_change(breaking, category, detail)
 
     return api_changes
+
+
+def _get_content_changes(
+    subject: str,
+    new_content: Optional[Dict[str, MediaType]],
+    old_content: Optional[Dict[str, MediaType]],
+    direction: _Direction,
+    context: _DiffContext,
+) -> List[Tuple[bool, ChangeCategory, str]]:
+    changes = []
+    new_content = new_content or {}
+    old_content = old_content or {}
+    added_types, removed_types, remain_types = _get_added_removed_remain(
+        new_content, old_content
+    )
+    for media_type in sorted(removed_types):
+        changes.append(
+            (
+                True,
+                ChangeCategory.REMOVED,
+                f"{subject} '{media_type}' has been removed",
+            )
+        )
+    for media_type in sorted(added_types):
+        changes.append(
+            (False, ChangeCategory.ADDED, f"{subject} '{media_type}' has been added")
+        )
+    for media_type in sorted(remain_types):
+        for breaking, category, location, message in context.compare_schemas(
+            new_content[media_type].media_type_schema,
+            old_content[media_type].media_type_schema,
+            direction,
+        ):
+            changes.append(
+                (
+                    breaking,
+                    category,
+                    _describe(f"{subject} '{media_type}'", location, message),
+                )
+            )
+    return changes
+
+
+def _get_schema_changes(
+    new: Optional[Schema],
+    old: Optional[Schema],
+    direction: _Direction,
+    context: _DiffContext,
+) -> List[_SchemaChange]:
+    changes: List[_SchemaChange] = []
+    request = direction == _Direction.REQUEST
+    if new is None or old is None:
+        if new is not old:
+            changes.append((True, ChangeCategory.CHANGE, "", "schema has changed"))
+        return changes
+
+    if new.type != old.type:
+        changes.append(
+            (
+                True,
+                ChangeCategory.CHANGE,
+                "",
+                f"type has changed from '{old.type}' to '{new.type}'",
+            )
+        )
+    if new.schema_format != old.schema_format:
+        changes.append(
+            (
+                True,
+                ChangeCategory.CHANGE,
+                "",
+                f"format has changed from '{old.schema_format}' to '{new.schema_format}'",
+            )
+        )
+    if bool(new.nullable) != bool(old.nullable):
+        # Accepting null is fine for requests, sending it back is not for responses
+        changes.append(
+            (
+                bool(new.nullable) != request,
+                ChangeCategory.CHANGE,
+                "",
+                "is now nullable" if new.nullable else "is no longer nullable",
+            )
+        )
+
+    if new.enum is not None or old.enum is not None:
+        new_enum = new.enum or []
+        old_enum = old.enum or []
+        for value in old_enum:
+            if value not in new_enum:
+                changes.append(
+                    (
+                        request,
+                        ChangeCategory.REMOVED,
+                        "",
+                        f"enum value '{value}' has been removed",
+                    )
+                )
+        for value in new_enum:
+            if value not in old_enum:
+                changes.append(
+                    (
+                        not request,
+                        ChangeCategory.ADDED,
+                        "",
+                        f"enum value '{value}' has been added",
+                    )
+                )
+
+    new_properties = new.properties or {}
+    old_properties = old.properties or {}
+    new_required = set(new.required or [])
+    old_required = set(old.required or [])
+    added_props, removed_props, remain_props = _get_added_removed_remain(
+        new_properties, old_properties, include_none=True
+    )
+    for name in sorted(removed_props):
+        changes.append((not request, ChangeCategory.REMOVED, name, "has been removed"))
+    for name in sorted(added_props):
+        if name in new_required:
+            changes.append(
+                (request, ChangeCategory.ADDED, name, "has been added as required")
+            )
+        else:
+            changes.append((False, ChangeCategory.ADDED, name, "has been added"))
+    for name in sorted(remain_props):
+        if name in new_required and name not in old_required:
+            changes.append((request, ChangeCategory.CHANGE, name, "is now required"))
+        elif name in old_required and name not in new_required:
+            changes.append(
+                (not request, ChangeCategory.CHANGE, name, "is no longer required")
+            )
+        for breaking, category, location, message in context.compare_schemas(
+            new_properties[name], old_properties[name], direction
+        ):
+            changes.append(
+                (breaking, category, _join_location(name, location), message)
+            )
+
+    if new.items is not None or old.items is not None:
+        for breaking, category, location, message in context.compare_schemas(
+            new.items, old.items, direction
+        ):
+            changes.append(
+                (breaking, category, _join_location("[]", location), message)
+            )
+
+    for keyword in ("allOf", "anyOf", "oneOf"):
+        new_options = getattr(new, keyword) or []
+        old_options = getattr(old, keyword) or []
+        if len(new_options) != len(old_options):
+            changes.append(
+                (True, ChangeCategory.CHANGE, "", f"'{keyword}' options have changed")
+            )
+            continue
+        for new_option, old_option in zip(new_options, old_options):
+            changes.extend(context.compare_schemas(new_option, old_option, direction))
+
+    return changes
@@ -0,0 +1,73 @@
+import argparse
+import importlib
+import json
+import os
+import sys
+from typing import List, Optional
+
+from .app import FastAPIVersioned
+
+
+def import_app(path: str) -> FastAPIVersioned:
+    """
+    Import an app given as 'module:attribute', e.g. 'example:app'
+    """
+    module_name, _, attribute = path.partition(":")
+    if not module_name or not attribute:
+        raise ValueError(f"Expected the app as 'module:attribute', got '{path}'")
+    # Like uvicorn, allow importing apps from the directory the command is run in
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    module = importlib.import_module(module_name)
+    try:
+        app = getattr(module, attribute)
+    except AttributeError:
+        raise ValueError(f"Module '{module_name}' has no attribute '{attribute}'")
+    if not isinstance(app, FastAPIVersioned):
+        raise ValueError(f"'{path}' is not a FastAPIVersioned app")
+    return app
+
+
+def build_changelog(app_path: str, output: str, workers: Optional[int] = None):
+    app = import_app(app_path)
+    if workers:
+        app.build_version_changes(workers=workers)
+    artifact = app.dump_changelog()
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump(artifact, output_file, separators=(",", ":"))
+    print(f"Wrote the changelog of {len(artifact['versions'])} versions to '{output}'")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="fastapi-versioned")
+    subparsers = parser.add_subparsers(dest="command")
+
+    changelog_parser = subparsers.add_parser(
+        "changelog",
+        help="Build the changelog of an app ahead of time so it can be loaded with "
+        "FastAPIVersioned(changelog_artifact=...)",
+    )
+    changelog_parser.add_argument(
+        "app", help="The app to import as 'module:attribute', e.g. 'example:app'"
+    )
+    changelog_parser.add_argument(
+        "-o", "--output", default="changelog.json", help="Where to write the artifact"
+    )
+    changelog_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Build the version diffs using this many processes",
+    )
+
+    args = parser.parse_args(argv)
+    if args.command == "changelog":
+        try:
+            build_changelog(args.app, args.output, args.workers)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        parser.print_help()
+        return 2
+    return 0
@@ -1,11 +1,12 @@
 import importlib
 import pkgutil
 import re
-from typing import List
+from typing import List, Optional
 
 from semantic_version import Version
 
 from fastapi_versioned import VersionRouter
+from fastapi_versioned.profiling import profile_phase
 
 module_regex = re.compile("v[0-9]+_[0-9]+_[0-9]+")
 
@@ -17,16 +18,78 @@ def _module_to_version(module_name: str) -> Version:
     return Version(module_name[1:].replace("_", "."))
 
 
-def detect_versions(path: str, name: str) -> List[VersionRouter]:
+def _import_version(module_name: str, package: str) -> VersionRouter:
+    with profile_phase("import", module_name[1:].replace("_", ".")):
+        module = importlib.import_module(f".{module_name}", package)
+    try:
+        return getattr(module, "version")
+    except AttributeError as e:
+        raise ImportError(f"Could not find 'version' attribute in module {module_name}")
+
+
+class LazyVersionRouter(VersionRouter):
+    """
+    Stands in for the VersionRouter of a version package that hasn't been imported yet. The version is taken from
+    the package name and the package is only imported once something needs its routes
+    """
+
+    def __init__(self, version: Version, module_name: str, package: str):
+        # VersionRouter.__init__ isn't called as everything other than the version is loaded on demand
+        self.version = version
+        self.module_name = module_name
+        self.package = package
+        self._loaded: Optional[VersionRouter] = None
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded is not None
+
+    def load(self) -> VersionRouter:
+        """
+        Import the version package if it hasn't been already
+
+        :return: The VersionRouter defined by the package
+        """
+        if self._loaded is None:
+            version_router = _import_version(self.module_name, self.package)
+            if version_router.version != self.version:
+                raise ImportError(
+                    f"Module {self.module_name} defines version '{version_router.version}' which doesn't match "
+                    f"its name"
+                )
+            self._loaded = version_router
+        return self._loaded
+
+    @property
+    def router(self):
+        return self.load().router
+
+    @property
+    def share_routes(self):
+        return self.load().share_routes
+
+    @property
+    def exception_handlers(self):
+        return self.load().exception_handlers
+
+
+def detect_versions(path: str, name: str, lazy: bool = False) -> List[VersionRouter]:
+    """
+    Find the version packages of an API, these are named after their version e.g. 'v1_2_0' and have a 'version'
+    attribute holding their VersionRouter
+
+    :param path: The __path__ of the package containing the versions
+    :param name: The __name__ of the package containing the versions
+    :param lazy: Don't import the version packages now, they are imported when their routes are first needed. Use
+        with FastAPIVersioned(lazy_versions=True) so they are only imported on the first request to each version
+    :return: The version routers
+    """
     versions = []
     for module_info in pkgutil.iter_modules(path):
-        module = importlib.import_module(f".{module_info.name}", name)
-        try:
-            version = getattr(module, "version")
-            versions.append(version)
-        except AttributeError as e:
-            raise ImportError(
-                f"Could not find 'version' attribute in module {module_info.name}"
-            )
+        if lazy:
+            version = _module_to_version(module_info.name)
+            versions.append(LazyVersionRouter(version, module_info.name, name))
+        else:
+            versions.append(_import_version(module_info.name, name))
 
     return versions
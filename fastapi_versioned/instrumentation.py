@@ -0,0 +1,87 @@
+import logging
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from .logger import logger
+
+
+class TimingEvent(NamedTuple):
+    # e.g. 'openapi', 'diff' or 'render'
+    name: str
+    # In seconds
+    duration: float
+    # What was timed e.g. {"version": "1.2.0", "previous_version": "1.1.0"}
+    fields: Dict[str, Any]
+
+
+Hook = Callable[[TimingEvent], None]
+
+_hooks: List[Hook] = []
+
+
+def add_hook(hook: Hook):
+    """
+    Call hook with a TimingEvent every time an instrumented step finishes. Events are also logged by the
+    'fastapi-versioned' logger at DEBUG level
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook: Hook):
+    _hooks.remove(hook)
+
+
+def emit(event: TimingEvent):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "%s took %.2fms %s",
+            event.name,
+            event.duration * 1000,
+            event.fields,
+            extra={"timing_event": event},
+        )
+    for hook in list(_hooks):
+        hook(event)
+
+
+class _Timer:
+    __slots__ = ("name", "fields", "start")
+
+    def __init__(self, name: str, fields: Dict[str, Any]):
+        self.name = name
+        self.fields = fields
+        self.start = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> Optional[bool]:
+        emit(TimingEvent(self.name, time.perf_counter() - self.start, self.fields))
+        return None
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullTimer":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> Optional[bool]:
+        return None
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(name: str, **fields: Any):
+    """
+    Time the body of a with block and emit it as a TimingEvent. When nothing is listening this returns a shared
+    no-op context manager so instrumented code costs a couple of checks
+
+    :param name: The name of the step being timed
+    :param fields: Details of what is being timed, passed on with the event
+    """
+    if not _hooks and not logger.isEnabledFor(logging.DEBUG):
+        return _NULL_TIMER
+    return _Timer(name, fields)
@@ -0,0 +1,119 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Upper bounds of the latency histogram buckets in seconds, anything slower goes in a final unbounded bucket
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# (version, route path template, method). The route is None for requests that didn't match an API route
+MetricsKey = Tuple[str, Optional[str], str]
+
+
+class _Series:
+    __slots__ = ("count", "errors", "total_seconds", "last_request", "buckets")
+
+    def __init__(self, bucket_count: int):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.last_request = 0.0
+        self.buckets = [0] * bucket_count
+
+
+class MetricsCollector:
+    """
+    Request counts and latency histograms keyed by (version, route template, method).
+
+    Every thread records into a dict of its own so recording never takes a lock, the dicts of all threads are
+    summed when the metrics are read. Reads may miss requests that are being recorded at the same time.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._stores: List[Dict[MetricsKey, _Series]] = []
+        # Only taken the first time a thread records
+        self._stores_lock = threading.Lock()
+
+    def _get_store(self) -> Dict[MetricsKey, _Series]:
+        try:
+            return self._local.store
+        except AttributeError:
+            store: Dict[MetricsKey, _Series] = {}
+            with self._stores_lock:
+                self._stores.append(store)
+            self._local.store = store
+            return store
+
+    def record(
+        self,
+        version: str,
+        route: Optional[str],
+        method: str,
+        duration: float,
+        status_code: int,
+    ):
+        """
+        :param version: The version that served the request
+        :param route: The path template of the route that served it, e.g. '/items/{item_id}'
+        :param method: The HTTP method
+        :param duration: How long the request took in seconds
+        :param status_code: The status of the response, 5xx responses are counted as errors
+        """
+        store = self._get_store()
+        key = (version, route, method)
+        series = store.get(key)
+        if series is None:
+            series = store[key] = _Series(len(self.buckets) + 1)
+        series.count += 1
+        if status_code >= 500:
+            series.errors += 1
+        series.total_seconds += duration
+        series.last_request = time.time()
+        series.buckets[bisect_left(self.buckets, duration)] += 1
+
+    def snapshot(self) -> Dict[MetricsKey, Dict[str, Any]]:
+        """
+        :return: The metrics of each (version, route, method) summed over all threads. Each has the request
+            'count', 'errors', 'total_seconds', the unix time of the 'last_request' and the 'buckets' of the
+            latency histogram, which line up with self.buckets plus one for slower requests
+        """
+        with self._stores_lock:
+            stores = list(self._stores)
+        merged: Dict[MetricsKey, Dict[str, Any]] = {}
+        for store in stores:
+            # Copying the dict is atomic so it can't change size while it's read
+            for key, series in store.copy().items():
+                totals = merged.get(key)
+                if totals is None:
+                    totals = merged[key] = {
+                        "count": 0,
+                        "errors": 0,
+                        "total_seconds": 0.0,
+                        "last_request": 0.0,
+                        "buckets": [0] * (len(self.buckets) + 1),
+                    }
+                totals["count"] += series.count
+                totals["errors"] += series.errors
+                totals["total_seconds"] += series.total_seconds
+                totals["last_request"] = max(
+                    totals["last_request"], series.last_request
+                )
+                for index, count in enumerate(series.buckets):
+                    totals["buckets"][index] += count
+        return merged
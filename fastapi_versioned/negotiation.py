@@ -0,0 +1,156 @@
+import re
+from bisect import insort
+from typing import Dict, List, Optional, Tuple
+
+from semantic_version import NpmSpec, Version
+from starlette.types import Scope
+
+# e.g. 'application/vnd.example.v2+json', the vendor name isn't checked
+_MEDIA_TYPE_REGEX = re.compile(rb"application/vnd\.[^.;,\s]+\.v([0-9][^+;,\s]*)\+json")
+
+# Only values starting with one of these are parsed as ranges, so arbitrary paths like '/vx/' aren't served
+_RANGE_OPERATORS = ("~", "^", "<", ">", "=")
+
+
+class VersionIndex:
+    """
+    Maps every string a client can ask for a version with onto that version, so resolving one is a dict lookup.
+
+    Besides the full version ('1.2.0') the index holds each major ('1') and major.minor ('1.2') mapped to the
+    latest release of it, and 'latest'. Pre-releases are only reachable by their full version. A leading 'v' is
+    ignored.
+
+    Values starting with a range operator are treated as npm style ranges such as '~1.2', '^1' or '>=1.1 <2' and
+    resolved to the highest version in the range. Each range is only resolved once, up to range_cache_size of them.
+    Anything else isn't served
+    """
+
+    def __init__(self, range_cache_size: int = 1024):
+        self.versions: List[Version] = []
+        self.range_cache_size = range_cache_size
+        self._lookup: Dict[str, Version] = {}
+        self._ranges: Dict[str, Optional[Version]] = {}
+        self._latest: Optional[Version] = None
+
+    def add(self, version: Version):
+        if version in self.versions:
+            return
+        insort(self.versions, version)
+        self._build()
+
+    def _build(self):
+        lookup = {}
+        # Versions are in ascending order so the latest of each major and minor overwrites the others
+        for version in self.versions:
+            if not version.prerelease:
+                lookup[f"{version.major}"] = version
+                lookup[f"{version.major}.{version.minor}"] = version
+        for version in self.versions:
+            lookup[str(version)] = version
+        releases = [version for version in self.versions if not version.prerelease]
+        latest = (releases or self.versions)[-1]
+        lookup["latest"] = latest
+        self._lookup = lookup
+        self._ranges = {}
+        self._latest = latest
+
+    @property
+    def latest(self) -> Optional[Version]:
+        """
+        The latest release, or the latest pre-release if there aren't any releases
+        """
+        return self._latest
+
+    def resolve(self, value: str, allow_prefix: bool = True) -> Optional[Version]:
+        """
+        :param value: What the client asked for e.g. '1.2.0', 'v1', '1.2', 'latest' or '^1.2'
+        :param allow_prefix: Ignore a leading 'v'. Not wanted for paths where the prefix has already been removed
+        :return: The version or None if it isn't served
+        """
+        value = value.strip()
+        if allow_prefix and value[:1] in ("v", "V"):
+            value = value[1:]
+        version = self._lookup.get(value)
+        if version is None and value.startswith(_RANGE_OPERATORS):
+            try:
+                version = self._ranges[value]
+            except KeyError:
+                version = self._resolve_range(value)
+        return version
+
+    def _resolve_range(self, value: str) -> Optional[Version]:
+        try:
+            version = NpmSpec(value).select(self.versions)
+        except ValueError:
+            version = None
+        if len(self._ranges) >= self.range_cache_size:
+            self._ranges = {}
+        self._ranges[value] = version
+        return version
+
+
+class VersionNegotiator:
+    """
+    Picks the version of a request that doesn't have a version in its path from its headers, in order:
+    - The version header e.g. 'Accept-Version: 1.2'
+    - A vendor media type in Accept e.g. 'Accept: application/vnd.example.v1+json'
+    - The latest version if neither ask for one
+
+    The header values clients send hardly vary so their resolutions are memoized, up to cache_size of them.
+    """
+
+    def __init__(
+        self,
+        index: VersionIndex,
+        header: str = "Accept-Version",
+        cache_size: int = 1024,
+    ):
+        self.index = index
+        self.header = header.lower().encode("latin-1")
+        self.cache_size = cache_size
+        self._cache: Dict[Tuple[bool, bytes], Optional[Version]] = {}
+
+    def clear(self):
+        """
+        Forget the memoized resolutions, needed when versions are added
+        """
+        self._cache = {}
+
+    def _resolve(self, is_media_type: bool, value: bytes) -> Optional[Version]:
+        if is_media_type:
+            match = _MEDIA_TYPE_REGEX.search(value)
+            if match is None:
+                # Accept without a vendor media type doesn't ask for a version
+                return self.index.latest
+            value = match.group(1)
+        return self.index.resolve(value.decode("latin-1"))
+
+    def select(self, scope: Scope) -> Optional[Version]:
+        """
+        :return: The version the request asks for, the latest version if it doesn't ask for one or None if it asks
+            for a version that isn't served
+        """
+        requested = None
+        accept = None
+        for name, value in scope.get("headers", ()):
+            if name == self.header:
+                requested = value
+                break
+            elif name == b"accept":
+                accept = value
+        if requested is not None:
+            key = (False, requested)
+        elif accept is not None:
+            key = (True, accept)
+        else:
+            return self.index.latest
+
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        version = self._resolve(*key)
+        if len(self._cache) >= self.cache_size:
+            self._cache = {}
+        self._cache[key] = version
+        return version
@@ -0,0 +1,223 @@
+import inspect
+import warnings
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.openapi.models import Components, OpenAPI, PathItem, Schema
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+from starlette.routing import BaseRoute
+
+try:
+    from fastapi.openapi.utils import get_flat_models_from_routes, get_openapi_path
+    from fastapi.utils import get_model_definitions
+    from pydantic.schema import get_flat_models_from_model, get_model_name_map
+except ImportError as e:
+    # FastAPI 0.100 moved these into its pydantic compatibility layer
+    raise ImportError(
+        "incremental_openapi relies on internals of FastAPI before 0.100 and pydantic 1"
+    ) from e
+
+# Older versions of FastAPI don't track operation ids while generating paths
+_PASS_OPERATION_IDS = "operation_ids" in inspect.signature(get_openapi_path).parameters
+
+
+_OPENAPI_KEYS = [field.alias for field in OpenAPI.__fields__.values()]
+_PATH_ITEM_KEYS = [field.alias for field in PathItem.__fields__.values()]
+_COMPONENTS_KEYS = [field.alias for field in Components.__fields__.values()]
+
+
+def _order_keys(value: Dict[str, Any], keys: List[str]) -> Dict[str, Any]:
+    ordered = {key: value[key] for key in keys if key in value}
+    if len(ordered) != len(value):
+        ordered.update(value)
+    return ordered
+
+
+def _model_sort_key(model: type) -> Tuple[str, str]:
+    return model.__module__, model.__qualname__
+
+
+class OpenAPIFragmentCache:
+    """
+    Generates OpenAPI documents from per route path items and per model component schemas that are kept between
+    versions.
+
+    Versions that inherit routes from each other reference the same route objects (see VersionRouter.share_routes)
+    so each route is only turned into OpenAPI once. A fragment also depends on the names the models it references
+    get in the document, which are only different when model names clash, so those names are part of the key.
+    """
+
+    def __init__(self):
+        # Keyed by id as starlette routes aren't hashable. The route is stored to keep the id from being reused
+        self._route_models: Dict[int, Tuple[APIRoute, List[type]]] = {}
+        self._paths: Dict[Tuple[int, Tuple[str, ...]], Tuple[APIRoute, Any]] = {}
+        self._model_nested: Dict[type, List[type]] = {}
+        self._definitions: Dict[Tuple[type, Tuple[str, ...]], Dict[str, Any]] = {}
+
+    def _get_route_models(self, route: APIRoute) -> List[type]:
+        cached = self._route_models.get(id(route))
+        if cached is None or cached[0] is not route:
+            models = sorted(get_flat_models_from_routes([route]), key=_model_sort_key)
+            cached = self._route_models[id(route)] = (route, models)
+        return cached[1]
+
+    def forget_routes(self, routes: Iterable[BaseRoute]):
+        """
+        Drop the fragments of routes that won't be used again, e.g. the copies held by an evicted version app. They
+        are keyed by id so would otherwise be kept forever
+        """
+        route_ids = {id(route) for route in routes}
+        for route_id in route_ids:
+            self._route_models.pop(route_id, None)
+        self._paths = {
+            key: cached
+            for key, cached in self._paths.items()
+            if key[0] not in route_ids
+        }
+
+    def _get_nested_models(self, model: type) -> List[type]:
+        nested = self._model_nested.get(model)
+        if nested is None:
+            if isinstance(model, type) and issubclass(model, BaseModel):
+                nested = sorted(get_flat_models_from_model(model), key=_model_sort_key)
+            else:
+                nested = [model]
+            self._model_nested[model] = nested
+        return nested
+
+    def _get_definitions(
+        self, model: type, model_name_map: Dict[type, str]
+    ) -> Dict[str, Any]:
+        key = (
+            model,
+            tuple(model_name_map[nested] for nested in self._get_nested_models(model)),
+        )
+        definitions = self._definitions.get(key)
+        if definitions is None:
+            definitions = {
+                name: jsonable_encoder(
+                    Schema(**definition), by_alias=True, exclude_none=True
+                )
+                for name, definition in get_model_definitions(
+                    flat_models={model}, model_name_map=model_name_map
+                ).items()
+            }
+            self._definitions[key] = definitions
+        return definitions
+
+    def _get_path(
+        self, route: APIRoute, models: List[type], model_name_map: Dict[type, str]
+    ) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+        key = (id(route), tuple(model_name_map[model] for model in models))
+        cached = self._paths.get(key)
+        if cached is None or cached[0] is not route:
+            kwargs = {"operation_ids": set()} if _PASS_OPERATION_IDS else {}
+            result = get_openapi_path(
+                route=route, model_name_map=model_name_map, **kwargs
+            )
+            path, security_schemes, path_definitions = result or ({}, {}, {})
+            path = jsonable_encoder(PathItem(**path), by_alias=True, exclude_none=True)
+            cached = self._paths[key] = (
+                route,
+                (path, security_schemes, path_definitions),
+            )
+        return cached[1]
+
+    def get_openapi(self, app: FastAPI) -> Dict[str, Any]:
+        """
+        Build the same document as app.openapi() would, reusing fragments generated for previous versions
+
+        :param app: The version app to generate the schema of
+        :return: The OpenAPI document as a dict
+        """
+        routes = [
+            route
+            for route in app.routes
+            if isinstance(route, APIRoute) and route.include_in_schema
+        ]
+        route_models = [self._get_route_models(route) for route in routes]
+        flat_models: Set[type] = set()
+        for models in route_models:
+            flat_models.update(models)
+        model_name_map = get_model_name_map(flat_models)
+
+        definitions: Dict[str, Any] = {}
+        for model in sorted(flat_models, key=_model_sort_key):
+            definitions.update(self._get_definitions(model, model_name_map))
+
+        paths: Dict[str, Dict[str, Any]] = {}
+        security_schemes: Dict[str, Any] = {}
+        operation_ids: Set[str] = set()
+        for route, models in zip(routes, route_models):
+            path, route_security, path_definitions = self._get_path(
+                route, models, model_name_map
+            )
+            for operation in path.values():
+                operation_id = operation.get("operationId")
+                if operation_id in operation_ids:
+                    warnings.warn(
+                        f"Duplicate Operation ID {operation_id} for function "
+                        f"{route.endpoint.__name__}"
+                    )
+                operation_ids.add(operation_id)
+            if path:
+                paths.setdefault(route.path_format, {}).update(path)
+            security_schemes.update(route_security)
+            for name, definition in path_definitions.items():
+                definitions[name] = jsonable_encoder(
+                    Schema(**definition), by_alias=True, exclude_none=True
+                )
+
+        info: Dict[str, Any] = {"title": app.title, "version": app.version}
+        for key, attribute in (
+            ("summary", "summary"),
+            ("description", "description"),
+            ("termsOfService", "terms_of_service"),
+            ("contact", "contact"),
+            ("license", "license_info"),
+        ):
+            value = getattr(app, attribute, None)
+            if value:
+                info[key] = value
+        head: Dict[str, Any] = {"openapi": app.openapi_version, "info": info}
+        if app.servers:
+            head["servers"] = app.servers
+        if security_schemes:
+            head["components"] = {"securitySchemes": security_schemes}
+        if app.openapi_tags:
+            head["tags"] = app.openapi_tags
+        # Only the small top level part goes through the OpenAPI model, the fragments are already encoded
+        encoded = jsonable_encoder(OpenAPI(**head), by_alias=True, exclude_none=True)
+        if definitions:
+            components = encoded.setdefault("components", {})
+            components["schemas"] = {
+                name: definitions[name] for name in sorted(definitions)
+            }
+            encoded["components"] = _order_keys(components, _COMPONENTS_KEYS)
+        # Routes sharing a path are merged in route order, the PathItem model would order the methods by its fields
+        encoded["paths"] = {
+            path_format: _order_keys(path_item, _PATH_ITEM_KEYS)
+            for path_format, path_item in paths.items()
+        }
+
+        # Keep the key order of the document FastAPI generates
+        return _order_keys(encoded, _OPENAPI_KEYS)
+
+
+def use_fragment_cache(app: FastAPI, cache: OpenAPIFragmentCache):
+    """
+    Replace app.openapi so it builds its document from the fragment cache. The result is still stored on
+    app.openapi_schema like FastAPI does
+    """
+
+    def openapi() -> Dict[str, Any]:
+        if getattr(app, "webhooks", None) and app.webhooks.routes:
+            # Webhooks aren't cached, let FastAPI build the whole document
+            return FastAPI.openapi(app)
+        if not app.openapi_schema:
+            app.openapi_schema = cache.get_openapi(app)
+        return app.openapi_schema
+
+    app.openapi = openapi
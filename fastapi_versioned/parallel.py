@@ -0,0 +1,48 @@
+import multiprocessing
+from typing import Any, Dict, List, Sequence, Tuple
+
+from fastapi import FastAPI
+from openapi_schema_pydantic import OpenAPI
+
+from .changelog import APIChangeList, OpenAPIFingerprints, compare_openapi
+
+# Set in the parent just before the pool forks so the workers inherit the apps instead of having to pickle them
+_apps: Sequence[FastAPI] = ()
+
+
+def _generate_openapi(index: int) -> Dict[str, Any]:
+    return _apps[index].openapi()
+
+
+def _compare_schemas(schemas: Tuple[Dict[str, Any], Dict[str, Any]]) -> APIChangeList:
+    new_schema, old_schema = schemas
+    return compare_openapi(
+        OpenAPI.parse_obj(new_schema),
+        OpenAPI.parse_obj(old_schema),
+        OpenAPIFingerprints(new_schema),
+        OpenAPIFingerprints(old_schema),
+    )
+
+
+def build_changes_in_pool(
+    apps: Sequence[FastAPI], workers: int
+) -> Tuple[List[Dict[str, Any]], List[APIChangeList]]:
+    """
+    Generate the OpenAPI schema of every app and diff each adjacent pair using a pool of forked processes
+
+    :param apps: The version apps sorted by version
+    :param workers: The number of processes to use
+    :return: The schema of each app and the changes between each app and the one before it
+    """
+    global _apps
+    # Raises ValueError on platforms that can't fork, the caller falls back to working serially
+    context = multiprocessing.get_context("fork")
+    _apps = apps
+    try:
+        # A Pool of the context rather than ProcessPoolExecutor(mp_context=...) which needs Python 3.7
+        with context.Pool(processes=workers) as pool:
+            schemas = list(pool.map(_generate_openapi, range(len(apps))))
+            changes = list(pool.map(_compare_schemas, zip(schemas[1:], schemas[:-1])))
+    finally:
+        _apps = ()
+    return schemas, changes
@@ -0,0 +1,189 @@
+import json
+import os
+import time
+import tracemalloc
+from typing import Any, Dict, Optional
+
+from . import instrumentation
+from .logger import logger
+
+# Set to profile from when fastapi_versioned is imported, covering the phases before the app exists such as the
+# imports of detect_versions. Set it to 'log' to also log the report
+PROFILE_ENV_VAR = "FASTAPI_VERSIONED_PROFILE_STARTUP"
+
+
+class _Phase:
+    __slots__ = ("profiler", "name", "version", "start", "start_memory")
+
+    def __init__(self, profiler: "StartupProfiler", name: str, version: Optional[str]):
+        self.profiler = profiler
+        self.name = name
+        self.version = version
+
+    def __enter__(self) -> "_Phase":
+        self.start_memory = self.profiler._traced_memory()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> Optional[bool]:
+        seconds = time.perf_counter() - self.start
+        allocated = self.profiler._traced_memory() - self.start_memory
+        self.profiler.record(self.name, self.version, seconds, allocated)
+        return None
+
+
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullPhase":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> Optional[bool]:
+        return None
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class StartupProfiler:
+    """
+    Records the wall time and memory allocated by each phase of starting up, in total and per version.
+
+    Memory is measured with tracemalloc, which is started if it isn't already and slows everything down while it
+    runs, so the times are best compared with each other rather than with an unprofiled start. Phases can be
+    nested (importing a version package builds its VersionRouter) and each includes the phases within it. The
+    timing events of the instrumentation module, e.g. OpenAPI generation, are recorded too.
+    """
+
+    def __init__(self, trace_memory: bool = True, log_report: bool = False):
+        """
+        :param trace_memory: Measure the memory allocated by each phase as well as its time
+        :param log_report: Log a summary of the report once startup is finished
+        """
+        self.trace_memory = trace_memory
+        self.log_report = log_report
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self.versions: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self.events: Dict[str, Dict[str, float]] = {}
+        self._started_tracing = False
+        self._start = 0.0
+        self._seconds: Optional[float] = None
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        instrumentation.add_hook(self._record_event)
+        self._start = time.perf_counter()
+
+    def stop(self):
+        self._seconds = time.perf_counter() - self._start
+        instrumentation.remove_hook(self._record_event)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _traced_memory(self) -> int:
+        return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+    def phase(self, name: str, version: Optional[str] = None) -> _Phase:
+        return _Phase(self, name, version)
+
+    @staticmethod
+    def _add(
+        totals: Dict[str, Dict[str, float]], name: str, seconds: float, allocated: int
+    ):
+        phase = totals.get(name)
+        if phase is None:
+            phase = totals[name] = {"count": 0, "seconds": 0.0, "allocated_bytes": 0}
+        phase["count"] += 1
+        phase["seconds"] += seconds
+        phase["allocated_bytes"] += allocated
+
+    def record(self, name: str, version: Optional[str], seconds: float, allocated: int):
+        self._add(self.phases, name, seconds, allocated)
+        if version is not None:
+            self._add(self.versions.setdefault(version, {}), name, seconds, allocated)
+
+    def _record_event(self, event: instrumentation.TimingEvent):
+        self._add(self.events, event.name, event.duration, 0)
+        version = event.fields.get("version")
+        if version is not None:
+            self._add(
+                self.versions.setdefault(version, {}), event.name, event.duration, 0
+            )
+
+    def report(self) -> Dict[str, Any]:
+        """
+        :return: The total time profiled, the totals of each phase and instrumentation event, and each version's
+            share of them. Each total has its 'count', 'seconds' and 'allocated_bytes'
+        """
+        seconds = self._seconds
+        if seconds is None:
+            seconds = time.perf_counter() - self._start
+        return {
+            "total_seconds": seconds,
+            "phases": self.phases,
+            "events": self.events,
+            "versions": self.versions,
+        }
+
+    def log(self):
+        report = self.report()
+        logger.info(f"Startup took {report['total_seconds']:.3f}s")
+        for name, phase in sorted(
+            report["phases"].items(), key=lambda item: item[1]["seconds"], reverse=True
+        ):
+            logger.info(
+                f"Startup phase '{name}' x{phase['count']}: {phase['seconds']:.3f}s, "
+                f"{phase['allocated_bytes'] / 2 ** 20:.1f} MiB allocated"
+            )
+        slowest = sorted(
+            report["versions"].items(),
+            key=lambda item: sum(phase["seconds"] for phase in item[1].values()),
+            reverse=True,
+        )
+        for version, phases in slowest[:10]:
+            logger.info(f"Startup of version {version}: {json.dumps(phases)}")
+
+
+_active: Optional[StartupProfiler] = None
+
+
+def enable_startup_profiling(
+    trace_memory: bool = True, log_report: bool = False
+) -> StartupProfiler:
+    """
+    Start profiling now, before the app is created, so phases like the imports of detect_versions are included.
+    The next FastAPIVersioned to be created takes over the profiler and stops it once it's constructed
+    """
+    global _active
+    if _active is None:
+        _active = StartupProfiler(trace_memory=trace_memory, log_report=log_report)
+        _active.start()
+    return _active
+
+
+def take_active_profiler() -> Optional[StartupProfiler]:
+    """
+    :return: The profiler started by enable_startup_profiling if there is one, which is no longer active
+    """
+    global _active
+    profiler, _active = _active, None
+    return profiler
+
+
+def profile_phase(name: str, version: Any = None):
+    """
+    Profile the body of a with block as a phase of startup if profiling is enabled, otherwise do nothing
+
+    :param name: The name of the phase, e.g. 'import'
+    :param version: The version the phase is for if any
+    """
+    if _active is None:
+        return _NULL_PHASE
+    return _active.phase(name, str(version) if version is not None else None)
+
+
+if os.environ.get(PROFILE_ENV_VAR):
+    enable_startup_profiling(log_report=os.environ[PROFILE_ENV_VAR] == "log")
@@ -0,0 +1,37 @@
+import hashlib
+from typing import Dict, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+class CachedContent:
+    """
+    A response body that has been rendered once and is served as is with an ETag so clients can revalidate using
+    If-None-Match and get a 304 back
+    """
+
+    def __init__(
+        self, body: bytes, media_type: str, cache_control: Optional[str] = None
+    ):
+        self.body = body
+        self.media_type = media_type
+        self.etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self.headers: Dict[str, str] = {"ETag": self.etag}
+        if cache_control:
+            self.headers["Cache-Control"] = cache_control
+
+    def matches(self, request: Request) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*" or tag == self.etag or tag == "W/" + self.etag:
+                return True
+        return False
+
+    def response(self, request: Request) -> Response:
+        if self.matches(request):
+            return Response(status_code=304, headers=self.headers)
+        return Response(self.body, media_type=self.media_type, headers=self.headers)
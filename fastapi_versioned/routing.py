@@ -1,20 +1,535 @@
-from typing import Callable, List, Optional
+import fnmatch
+import re
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Pattern,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
 from fastapi import APIRouter
+from semantic_version import Version
+from starlette.datastructures import URLPath
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+from starlette.routing import (
+    BaseRoute,
+    Match,
+    Mount,
+    NoMatchFound,
+    Router,
+    WebSocketRoute,
+)
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from starlette.websockets import WebSocketClose
+
+from .metrics import MetricsCollector
+from .negotiation import VersionIndex, VersionNegotiator
+
+# A view function, a route, a router or Mount whose routes should all be excluded, a path or a (method, path) pair
+ExcludedRoute = Union[Callable, BaseRoute, Router, str, Tuple[str, str]]
+
+
+class RouteExclusion:
+    """
+    The routes to leave out of a version, indexed so checking a route is a few set lookups rather than a scan of
+    everything excluded.
+
+    Routes can be excluded by:
+    - Their endpoint (view function), or a route or router. Routers and Mounts exclude the endpoints of every route
+      nested in them, however deep
+    - A path such as '/items/{item_id}' which excludes every method of the route
+    - A (method, path) tuple such as ('GET', '/items/{item_id}')
+
+    Paths may be glob patterns e.g. '/items/*'. A route serving several methods is excluded if any of them match
+    """
+
+    def __init__(self, excluded: Iterable[ExcludedRoute]):
+        self.endpoints: Set[Callable] = set()
+        # A method of None matches any method
+        self.paths: Set[Tuple[Optional[str], str]] = set()
+        self.path_patterns: List[Tuple[Optional[str], Pattern]] = []
+        for item in excluded:
+            self._add(item)
+
+    def _add(self, item: ExcludedRoute):
+        if isinstance(item, str):
+            self._add_path(None, item)
+        elif isinstance(item, tuple):
+            method, path = item
+            self._add_path(method.upper(), path)
+        elif hasattr(item, "routes"):
+            for route in item.routes:
+                self._add(route)
+        elif isinstance(item, BaseRoute):
+            endpoint = getattr(item, "endpoint", None)
+            if endpoint is not None:
+                self.endpoints.add(endpoint)
+        else:
+            self.endpoints.add(item)
+
+    def _add_path(self, method: Optional[str], path: str):
+        if any(character in path for character in "*?["):
+            self.path_patterns.append((method, re.compile(fnmatch.translate(path))))
+        else:
+            self.paths.add((method, path))
+
+    def __bool__(self) -> bool:
+        return bool(self.endpoints or self.paths or self.path_patterns)
+
+    def __contains__(self, route: BaseRoute) -> bool:
+        endpoint = getattr(route, "endpoint", None)
+        if endpoint is not None and endpoint in self.endpoints:
+            return True
+        path = getattr(route, "path", None)
+        if path is None:
+            return False
+        methods = getattr(route, "methods", None) or ()
+        if (None, path) in self.paths or any(
+            (method, path) in self.paths for method in methods
+        ):
+            return True
+        return any(
+            (method is None or method in methods) and pattern.match(path)
+            for method, pattern in self.path_patterns
+        )
+
+
+Exclude = Union[RouteExclusion, Iterable[ExcludedRoute]]
+
+
+def _as_exclusion(exclude: Optional[Exclude]) -> Optional[RouteExclusion]:
+    if exclude is None or isinstance(exclude, RouteExclusion):
+        return exclude
+    return RouteExclusion(exclude)
 
 
 def include_router(
     new_router: APIRouter,
     old_router: APIRouter,
-    exclude: Optional[List[Callable]] = None,
+    exclude: Optional[Exclude] = None,
 ):
+    """
+    Add copies of the routes of old_router to new_router
+
+    :param new_router: The router to add the routes to
+    :param old_router: The router to copy the routes from
+    :param exclude: Routes of old_router that should not be copied, a RouteExclusion or a list of what it accepts
+    """
+    exclude = _as_exclusion(exclude)
+    first_included = len(new_router.routes)
     new_router.include_router(old_router)
 
     if exclude:
-        to_exclude = []
-        for route in new_router.routes:
-            if route.endpoint in exclude:
-                to_exclude.append(route)
+        # A single pass over the copies, the routes new_router already had are left alone
+        new_router.routes[first_included:] = [
+            route
+            for route in new_router.routes[first_included:]
+            if route not in exclude
+        ]
+
+
+def share_router(
+    new_router: Router,
+    old_router: Router,
+    exclude: Optional[Exclude] = None,
+):
+    """
+    Add the routes of old_router to new_router by reference.
+
+    APIRouter.include_router rebuilds every route (dependant graph, response fields and path regex) so each version
+    that inherits from another would hold its own copy. Here the same route objects are shared instead.
+
+    :param new_router: The router to add the routes to
+    :param old_router: The router to take the routes from
+    :param exclude: Routes of old_router that should not be shared, a RouteExclusion or a list of what it accepts
+    """
+    exclude = _as_exclusion(exclude)
+    if exclude:
+        new_router.routes.extend(
+            route for route in old_router.routes if route not in exclude
+        )
+    else:
+        new_router.routes.extend(old_router.routes)
+    new_router.on_startup.extend(old_router.on_startup)
+    new_router.on_shutdown.extend(old_router.on_shutdown)
+
+
+class DuplicateRouteError(ValueError):
+    pass
+
+
+_PATH_PARAM_REGEX = re.compile(r"{[^}:]*(:[^}]*)?}")
+
+
+def _path_shape(path: str) -> str:
+    """
+    The path with its parameter names dropped, so '/items/{id}' and '/items/{item_id}' have the same shape. The
+    convertor is kept as '{:path}' can match paths the other convertors can't
+    """
+    return _PATH_PARAM_REGEX.sub(lambda match: "{%s}" % (match.group(1) or ""), path)
+
+
+def _route_keys(
+    routes: Iterable[BaseRoute], prefix: str = ""
+) -> Iterable[Tuple[str, str, BaseRoute]]:
+    for route in routes:
+        path = prefix + getattr(route, "path", "")
+        if isinstance(route, Mount):
+            nested = route.routes
+            if nested:
+                yield from _route_keys(nested, path)
+            else:
+                # Mounted apps that aren't routers clash with each other as a whole
+                yield path, "MOUNT", route
+        elif isinstance(route, WebSocketRoute):
+            yield path, "WEBSOCKET", route
+        else:
+            methods = getattr(route, "methods", None)
+            # Starlette routes without methods accept any of them
+            for method in methods or ["*"]:
+                yield path, method, route
+
+
+def find_duplicate_routes(
+    routes: Iterable[BaseRoute],
+) -> Dict[Tuple[str, str], List[BaseRoute]]:
+    """
+    Find routes that would serve the same requests, in a single pass over the routes (and the routes of Mounts).
+
+    Paths are compared by shape so routes that only differ by the names of their path parameters clash. WebSocket
+    routes are compared with each other under the method 'WEBSOCKET'.
+
+    :param routes: The routes to check
+    :return: The clashing routes keyed by the (path, method) of the first of them, in route order
+    """
+    routes_by_key: Dict[Tuple[str, str], Tuple[str, List[BaseRoute]]] = {}
+    for path, method, route in _route_keys(routes):
+        key = (_path_shape(path), method)
+        found = routes_by_key.get(key)
+        if found is None:
+            routes_by_key[key] = (path, [route])
+        else:
+            found[1].append(route)
+    return {
+        (path, method): clashing
+        for (_, method), (path, clashing) in routes_by_key.items()
+        if len(clashing) > 1
+    }
+
+
+def _first_segment(path: str) -> str:
+    return path[1:].split("/", 1)[0]
+
+
+class IndexedAPIRouter(APIRouter):
+    """
+    An APIRouter that looks up the routes a request could match in dicts rather than trying every route in turn.
+
+    Routes without path parameters are indexed by their path and the rest by the first segment of their path, if
+    it's static. Routes starting with a parameter, root Mounts and routes that aren't path based are candidates
+    for every request. The candidates of each key are kept in route order so the first route to match still wins.
+    Requests none of the routes match are passed on to APIRouter, which redirects slashes or returns a 404.
+    """
+
+    @classmethod
+    def from_router(cls, router: APIRouter) -> "IndexedAPIRouter":
+        """
+        Make an indexed router with the same routes and settings as router, e.g. to replace the router of an app
+        before it has handled any requests
+        """
+        indexed = cls.__new__(cls)
+        indexed.__dict__.update(router.__dict__)
+        indexed.compile()
+        return indexed
+
+    def compile(self):
+        """
+        Build the route index. Done again automatically if the number of routes changes
+        """
+        static_paths: Dict[str, List[int]] = {}
+        segments: Dict[str, List[int]] = {}
+        everywhere: List[int] = []
+        for index, route in enumerate(self.routes):
+            path = getattr(route, "path", None)
+            if path is None:
+                everywhere.append(index)
+                continue
+            segment = _first_segment(path)
+            if "{" not in path and not isinstance(route, Mount):
+                static_paths.setdefault(path, []).append(index)
+            elif segment and "{" not in segment:
+                # Mounts match everything below their path so they are indexed like parameterised routes
+                segments.setdefault(segment, []).append(index)
+            else:
+                everywhere.append(index)
+
+        def in_order(indices: Iterable[int]) -> List[BaseRoute]:
+            return [self.routes[index] for index in sorted(set(indices))]
+
+        self._segment_routes = {
+            segment: in_order(indices + everywhere)
+            for segment, indices in segments.items()
+        }
+        self._static_routes = {
+            path: in_order(
+                indices + segments.get(_first_segment(path), []) + everywhere
+            )
+            for path, indices in static_paths.items()
+        }
+        self._other_routes = in_order(everywhere)
+        self._compiled_count = len(self.routes)
+
+    def candidate_routes(self, path: str) -> List[BaseRoute]:
+        """
+        :return: The routes that could match path, in route order
+        """
+        routes = self._static_routes.get(path)
+        if routes is None:
+            routes = self._segment_routes.get(_first_segment(path), self._other_routes)
+        return routes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await super().__call__(scope, receive, send)
+            return
+        if len(self.routes) != self._compiled_count:
+            self.compile()
+        if "router" not in scope:
+            scope["router"] = self
+
+        partial = None
+        for route in self.candidate_routes(scope["path"]):
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                scope.update(child_scope)
+                await route.handle(scope, receive, send)
+                return
+            elif match == Match.PARTIAL and partial is None:
+                partial = route
+                partial_scope = child_scope
+
+        if partial is not None:
+            # Routes for the path that don't accept the method, e.g. '405 Method Not Allowed'
+            scope.update(partial_scope)
+            await partial.handle(scope, receive, send)
+            return
+
+        await super().__call__(scope, receive, send)
+
+
+class VersionPipeline:
+    """
+    Runs requests through the routes of a version app without its middleware, for when the middleware of the
+    parent app is shared by every version.
+
+    The version app is still set as scope["app"] so request.app is the same as when the app is called. If the
+    version has exception handlers of its own, handle is an ExceptionMiddleware using them
+    """
+
+    __slots__ = ("app", "handle")
+
+    def __init__(self, app: ASGIApp, handle: ASGIApp):
+        self.app = app
+        self.handle = handle
+
+    @property
+    def routes(self) -> List[BaseRoute]:
+        return getattr(self.app, "routes", [])
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        scope["app"] = self.app
+        await self.handle(scope, receive, send)
+
+
+class VersionDispatcher(BaseRoute):
+    """
+    A single route that sends '/v{version}/...' requests to the matching version app.
+
+    Mounting every version separately means each request regex matches the mounts one after another. Here the
+    version segment is sliced out of the path once and looked up in a dict. The child scope is built the same way
+    as a starlette Mount so 'root_path' and 404 handling behave as if each version was mounted.
+
+    The app of a version is fetched through get_app when a request for it arrives so it can be built on demand.
+    URLs are built from the routes returned by get_routes, if given, so building one doesn't build every app.
+
+    With a negotiator, requests without a version in their path are sent to the version picked from their headers.
+    Only paths that none of parent_routes match are negotiated, so the routes of the parent app keep priority and
+    still answer other methods with a 405.
+
+    The version is set as scope["api_version"]. With a metrics collector each HTTP request is counted and timed
+    against its version and the route that served it.
+    """
+
+    def __init__(
+        self,
+        get_app: Callable[[Version], ASGIApp],
+        prefix: str = "/v",
+        negotiator: Optional[VersionNegotiator] = None,
+        metrics: Optional[MetricsCollector] = None,
+        parent_routes: Sequence[BaseRoute] = (),
+        get_routes: Optional[Callable[[Version], Sequence[BaseRoute]]] = None,
+    ):
+        self.get_app = get_app
+        self.prefix = prefix
+        self.negotiator = negotiator
+        self.metrics = metrics
+        self.parent_routes = parent_routes
+        self.get_routes = get_routes
+        self.versions: Dict[str, Version] = {}
+        # Resolves partial versions and ranges in paths such as '/v1/...' or '/vlatest/...'
+        self.index = negotiator.index if negotiator is not None else VersionIndex()
+
+    def add_version(self, version: Version):
+        self.versions[str(version)] = version
+        self.index.add(version)
+        if self.negotiator is not None:
+            self.negotiator.clear()
+
+    def matches(self, scope: Scope) -> Tuple[Match, Scope]:
+        if scope["type"] in ("http", "websocket"):
+            path: str = scope["path"]
+            if path.startswith(self.prefix):
+                # Like a Mount we need at least the trailing slash, "/v0.0.1" is left to the redirect_slashes logic
+                end = path.find("/", len(self.prefix))
+                requested = path[len(self.prefix) : None if end == -1 else end]
+                version = self.versions.get(requested)
+                if version is None:
+                    version = self.index.resolve(requested, allow_prefix=False)
+                if version is not None and end == -1:
+                    # Not negotiated either so the redirect to "/v0.0.1/" happens
+                    return Match.NONE, {}
+                if version is not None:
+                    # The app is only fetched in handle() as fetching it may build it
+                    root_path = scope.get("root_path", "")
+                    child_scope = {
+                        "path_params": dict(scope.get("path_params", {})),
+                        "app_root_path": scope.get("app_root_path", root_path),
+                        "root_path": root_path + path[:end],
+                        "path": path[end:],
+                        "api_version": version,
+                    }
+                    return Match.FULL, child_scope
+            if (
+                self.negotiator is not None
+                and self.versions
+                and not self._parent_matches(scope)
+            ):
+                # A version of None isn't served and gets a 406
+                return (
+                    Match.PARTIAL,
+                    {
+                        "api_version": self.negotiator.select(scope),
+                        "version_negotiated": True,
+                    },
+                )
+        return Match.NONE, {}
+
+    def _parent_matches(self, scope: Scope) -> bool:
+        scopes = [scope]
+        path = scope["path"]
+        if path != "/":
+            # Paths the parent would redirect to with or without a trailing slash are left to it too
+            toggled = path[:-1] if path.endswith("/") else path + "/"
+            scopes.append({**scope, "path": toggled})
+        return any(
+            route is not self and route.matches(route_scope)[0] != Match.NONE
+            for route_scope in scopes
+            for route in self.parent_routes
+        )
+
+    def url_path_for(self, name: str, **path_params: Any) -> URLPath:
+        for version_str, version in self.versions.items():
+            # Looked up in the routes of the version rather than its app so no app has to be built
+            if self.get_routes is not None:
+                routes = self.get_routes(version)
+            else:
+                routes = getattr(self.get_app(version), "routes", [])
+            for route in routes:
+                try:
+                    url = route.url_path_for(name, **path_params)
+                except NoMatchFound:
+                    continue
+                return URLPath(
+                    path=f"{self.prefix}{version_str}" + str(url),
+                    protocol=url.protocol,
+                )
+        raise NoMatchFound(name, path_params)
+
+    async def handle(self, scope: Scope, receive: Receive, send: Send) -> None:
+        version = scope["api_version"]
+        if scope["type"] == "http" and scope.get("version_negotiated"):
+            send = self._send_with_vary(send)
+        if version is None:
+            await self._unsupported_version(scope, receive, send)
+            return
+        scope["endpoint"] = self.get_app(version)
+        if scope["type"] == "http" and self.metrics is not None:
+            await self._handle_measured(scope, receive, send)
+            return
+        await scope["endpoint"](scope, receive, send)
+
+    def _send_with_vary(self, send: Send) -> Send:
+        # The same URL serves different versions so caches have to key on the headers that chose it
+        vary = self.negotiator.header + b", accept"
+
+        async def send_with_vary(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), (b"vary", vary)]
+            await send(message)
+
+        return send_with_vary
+
+    async def _handle_measured(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        # Left as a 500 if the app raises before it responds
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await scope["endpoint"](scope, receive, send_with_status)
+        except HTTPException as exc:
+            # With shared_middleware the parent's ExceptionMiddleware turns these into responses after this returns
+            if status_code == 500:
+                status_code = exc.status_code
+            raise
+        finally:
+            # The version app's router has set the route on the scope by now
+            route = scope.get("route")
+            self.metrics.record(
+                str(scope["api_version"]),
+                getattr(route, "path", None),
+                scope["method"],
+                time.perf_counter() - start,
+                status_code,
+            )
+
+    async def _unsupported_version(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope["type"] == "websocket":
+            response = WebSocketClose()
+        else:
+            response = JSONResponse(
+                {"detail": "The requested API version is not supported"},
+                status_code=406,
+            )
+        await response(scope, receive, send)
 
-        for excluded in to_exclude:
-            new_router.routes.remove(excluded)
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(prefix={self.prefix!r}, versions={list(self.versions)!r})"
@@ -51,4 +51,5 @@ setup(
         "Jinja2>2.11",
     ],
     extras_require={"dev": ["pytest>=6.0.0", "requests>=2.24.0"]},
+    entry_points={"console_scripts": ["fastapi-versioned=fastapi_versioned.cli:main"]},
 )
@@ -0,0 +1,6 @@
+"""
+The same as the 'detectable' API but its versions are only imported when they are needed
+"""
+from fastapi_versioned.detection import detect_versions
+
+versions = detect_versions(__path__, __name__, lazy=True)
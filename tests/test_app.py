@@ -1,9 +1,24 @@
-from fastapi import APIRouter
+import json
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import APIRouter, Depends, HTTPException
 from fastapi.requests import Request
 from semantic_version import Version
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse
 from starlette.testclient import TestClient
 
-from fastapi_versioned import FastAPIVersioned, VersionRouter
+from fastapi_versioned import (
+    DuplicateRouteError,
+    FastAPIVersioned,
+    VersionRouter,
+    instrumentation,
+    profiling,
+)
+from fastapi_versioned.routing import include_router, share_router
 
 EXAMPLE_MESSAGE = {"message": "success"}
 
@@ -136,6 +151,80 @@ def test_create_two_versions_with_base_sub_router():
     assert response.status_code == 404
 
 
+def test_remove_nested_sub_router():
+    version = VersionRouter(Version("0.0.1"))
+    sub_router = APIRouter()
+    nested_router = APIRouter()
+
+    @nested_router.get("/nested")
+    def nested_route():
+        return EXAMPLE_MESSAGE
+
+    @sub_router.get("/kept")
+    def kept_route():
+        return EXAMPLE_MESSAGE
+
+    sub_router.include_router(nested_router)
+    version.router.include_router(sub_router, prefix="/resource")
+
+    version2 = VersionRouter(Version("0.0.2"), base=version.without([nested_router]))
+    client = TestClient(FastAPIVersioned(versions=[version, version2]))
+
+    assert client.get("/v0.0.2/resource/kept").status_code == 200
+    assert client.get("/v0.0.1/resource/nested").status_code == 200
+    assert client.get("/v0.0.2/resource/nested").status_code == 404
+
+
+def test_remove_routes_by_path_and_method():
+    version = VersionRouter(Version("0.0.1"), share_routes=True)
+
+    @version.router.get("/items/{item_id}")
+    def get_item(item_id: int):
+        return EXAMPLE_MESSAGE
+
+    @version.router.delete("/items/{item_id}")
+    def delete_item(item_id: int):
+        return EXAMPLE_MESSAGE
+
+    @version.router.get("/users/{user_id}")
+    def get_user(user_id: int):
+        return EXAMPLE_MESSAGE
+
+    @version.router.get("/users/{user_id}/items")
+    def get_user_items(user_id: int):
+        return EXAMPLE_MESSAGE
+
+    version2 = VersionRouter(
+        Version("0.0.2"),
+        base=version.without([("DELETE", "/items/{item_id}"), "/users/*/items"]),
+    )
+    client = TestClient(FastAPIVersioned(versions=[version, version2]))
+
+    assert client.get("/v0.0.2/items/1").status_code == 200
+    assert client.delete("/v0.0.2/items/1").status_code == 405
+    assert client.get("/v0.0.2/users/1").status_code == 200
+    assert client.get("/v0.0.2/users/1/items").status_code == 404
+    assert client.delete("/v0.0.1/items/1").status_code == 200
+    assert client.get("/v0.0.1/users/1/items").status_code == 200
+
+
+def test_include_router_exclude_list():
+    old_router = APIRouter()
+
+    @old_router.get("/a")
+    def route_a():
+        return EXAMPLE_MESSAGE
+
+    @old_router.get("/b")
+    def route_b():
+        return EXAMPLE_MESSAGE
+
+    for add_routes in (include_router, share_router):
+        new_router = APIRouter()
+        add_routes(new_router, old_router, exclude=[route_a])
+        assert [route.path for route in new_router.routes] == ["/b"]
+
+
 def test_version_router_duplicate_route():
     vr = VersionRouter(Version("0.0.1"))
 
@@ -166,6 +255,69 @@ def test_version_router_duplicate_route():
     }
 
 
+def test_version_router_duplicate_route_shapes():
+    vr = VersionRouter(Version("0.0.1"))
+
+    @vr.router.get("/items/{id}")
+    def test_1(id: int):
+        return {"detail": "test"}
+
+    @vr.router.get("/other/")
+    def test_2():
+        return {"detail": "test2"}
+
+    # Not next to its duplicate and only differs by the name of the path parameter
+    @vr.router.get("/items/{item_id}")
+    def test_3(item_id: int):
+        return {"detail": "test3"}
+
+    @vr.router.websocket("/socket")
+    async def socket_1(websocket):
+        pass
+
+    @vr.router.websocket("/socket")
+    async def socket_2(websocket):
+        pass
+
+    duplicate_endpoints = vr.duplicate_routes
+
+    assert set(duplicate_endpoints.keys()) == {
+        ("/items/{id}", "GET"),
+        ("/socket", "WEBSOCKET"),
+    }
+    assert [
+        route.endpoint for route in duplicate_endpoints[("/items/{id}", "GET")]
+    ] == [
+        test_1,
+        test_3,
+    ]
+
+
+def test_duplicate_routes_report():
+    vr = VersionRouter(Version("0.0.1"))
+
+    @vr.router.get("/tests/")
+    def test_1():
+        return {"detail": "test"}
+
+    @vr.router.get("/tests/")
+    def test_2():
+        return {"detail": "test2"}
+
+    api = FastAPIVersioned(versions=[vr])
+    assert [conflict.dict() for conflict in api.route_conflicts] == [
+        {
+            "version": "0.0.1",
+            "path": "/tests/",
+            "method": "GET",
+            "routes": ["test_1", "test_2"],
+        }
+    ]
+
+    with pytest.raises(DuplicateRouteError):
+        FastAPIVersioned(versions=[vr], fatal_duplicate_routes=True)
+
+
 def test_version_router_no_duplicate_route():
     vr = VersionRouter(Version("0.0.1"))
 
@@ -182,3 +334,584 @@ def test_version_router_no_duplicate_route():
         return {"detail": "test2"}
 
     assert len(vr.duplicate_routes) == 0
+
+
+def test_version_dispatch_root_path_and_not_found():
+    version = VersionRouter(Version("0.0.1"))
+
+    @version.router.get("/test")
+    def version_route(request: Request):
+        return {"root_path": request.scope["root_path"], "path": request.url.path}
+
+    api = FastAPIVersioned(title="Test API", versions=[version])
+
+    client = TestClient(api)
+
+    response = client.get(f"/v0.0.1/test")
+    assert response.status_code == 200
+    assert response.json() == {"root_path": "/v0.0.1", "path": "/v0.0.1/test"}
+
+    # Unknown versions and routes fall through to a 404 like a Mount would
+    assert client.get(f"/v0.0.3/test").status_code == 404
+    assert client.get(f"/v0.0.1/missing").status_code == 404
+    assert client.get(f"/v0.0.1.0/test").status_code == 404
+
+    # The bare mount point is redirected to the version root
+    response = client.get(f"/v0.0.1", allow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"].endswith("/v0.0.1/")
+
+
+def test_create_two_versions_sharing_routes():
+    version = VersionRouter(Version("0.0.1"), share_routes=True)
+
+    @version.router.get("/test")
+    def version_route(request: Request):
+        return EXAMPLE_MESSAGE
+
+    @version.router.get("/common_route")
+    def version_route_common(request: Request):
+        return {"version": str(request.app.version)}
+
+    version2 = VersionRouter(Version("0.0.2"), base=version.without([version_route]))
+    assert version2.share_routes
+
+    @version2.router.get("/test")
+    def version_route2(request: Request):
+        return {"detail": "overridden"}
+
+    # Only the new route is a new object, the common one is the same object in both versions
+    common_routes = [
+        route for route in version2.router.routes if route.path == "/common_route"
+    ]
+    assert len(common_routes) == 1
+    assert any(route is common_routes[0] for route in version.router.routes)
+
+    api = FastAPIVersioned(title="Test API", versions=[version, version2])
+
+    client = TestClient(api)
+
+    response = client.get(f"/v0.0.1/test")
+    assert response.json() == EXAMPLE_MESSAGE
+    response = client.get(f"/v0.0.2/test")
+    assert response.json() == {"detail": "overridden"}
+    response = client.get(f"/v0.0.1/common_route")
+    assert response.json() == {"version": "0.0.1"}
+    response = client.get(f"/v0.0.2/common_route")
+    assert response.json() == {"version": "0.0.2"}
+
+
+def test_app_dependencies_with_shared_routes():
+    def authenticate():
+        raise HTTPException(status_code=401)
+
+    def create_version(share_routes):
+        version = VersionRouter(Version("0.0.1"), share_routes=share_routes)
+        version.router.get("/items")(lambda: EXAMPLE_MESSAGE)
+        return version
+
+    api = FastAPIVersioned(
+        versions=[create_version(False)], dependencies=[Depends(authenticate)]
+    )
+    assert TestClient(api).get("/v0.0.1/items").status_code == 401
+
+    # Shared routes would skip the dependency so that's refused rather than serving them unauthenticated
+    with pytest.raises(ValueError):
+        FastAPIVersioned(
+            versions=[create_version(True)], dependencies=[Depends(authenticate)]
+        )
+    api = FastAPIVersioned(versions=[create_version(True)], include_in_schema=True)
+    assert TestClient(api).get("/v0.0.1/items").status_code == 200
+
+
+def _create_changing_versions():
+    version = VersionRouter(Version("0.0.1"))
+
+    @version.router.get("/test")
+    def version_route():
+        return EXAMPLE_MESSAGE
+
+    version2 = VersionRouter(Version("0.0.2"), base=version.without([version_route]))
+
+    @version2.router.post("/test")
+    def version_route2():
+        return EXAMPLE_MESSAGE
+
+    return version, version2
+
+
+def test_version_changes_are_memoized():
+    api = FastAPIVersioned(title="Test API", versions=_create_changing_versions())
+
+    key = (Version("0.0.2"), Version("0.0.1"))
+    change_list = api.get_version_changes()[key]
+    assert change_list.breaking_count == 1
+    assert change_list.change_count == 2
+    assert api.get_version_changes()[key] is change_list
+
+    api.invalidate_version_changes()
+    assert api.get_version_changes()[key] is not change_list
+
+
+def test_changes_endpoints():
+    client = TestClient(
+        FastAPIVersioned(title="Test API", versions=_create_changing_versions())
+    )
+
+    response = client.get("/changes/0.0.2")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["transition"] == {
+        "breaking": True,
+        "version_previous": "0.0.1",
+        "version_current": "0.0.2",
+        "version_previous_href": "/v0.0.1/",
+        "version_current_href": "/v0.0.2/",
+    }
+    assert body["total"] == 2
+    assert {(change["method"], change["category"]) for change in body["changes"]} == {
+        ("get", "removed"),
+        ("post", "added"),
+    }
+
+    response = client.get("/changes/latest", params={"breaking": True})
+    assert [change["method"] for change in response.json()["changes"]] == ["get"]
+    response = client.get("/changes/0.0.2", params={"method": "post", "path": "/t*"})
+    assert [change["method"] for change in response.json()["changes"]] == ["post"]
+    response = client.get("/changes/0.0.2", params={"offset": 1, "limit": 1})
+    assert response.json()["total"] == 2
+    assert len(response.json()["changes"]) == 1
+
+    response = client.get("/changes/0.0.1")
+    assert response.json()["transition"]["version_previous"] is None
+    assert response.json()["changes"] == []
+    assert client.get("/changes/0.0.3").status_code == 404
+
+    # Every href advertised by /versions is served
+    for version in client.get("/versions").json():
+        assert client.get(version["changes_href"]).status_code == 200
+
+    response = client.get("/changes", params={"limit": 1})
+    body = response.json()
+    assert body["total"] == 2
+    assert [
+        version["transition"]["version_current"] for version in body["versions"]
+    ] == ["0.0.2"]
+    response = client.get("/changes", params={"offset": 1})
+    assert [
+        version["transition"]["version_current"]
+        for version in response.json()["versions"]
+    ] == ["0.0.1"]
+
+
+def test_changelog_etag():
+    api = FastAPIVersioned(title="Test API", versions=_create_changing_versions())
+
+    client = TestClient(api)
+
+    response = client.get("/changelog")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/html")
+    etag = response.headers["etag"]
+
+    response = client.get("/changelog", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    response = client.get("/changelog", headers={"If-None-Match": '"stale"'})
+    assert response.status_code == 200
+
+
+def test_streaming_changelog():
+    page = TestClient(
+        FastAPIVersioned(title="Test API", versions=_create_changing_versions())
+    ).get("/changelog")
+
+    api = FastAPIVersioned(
+        title="Test API",
+        versions=_create_changing_versions(),
+        streaming_changelog=True,
+    )
+    response = TestClient(api).get("/changelog")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/html")
+    assert "etag" not in response.headers
+    assert response.text == page.text
+    # The diffs are kept but not the documents they were made from
+    assert len(api.get_version_changes()) == 1
+    assert api._openapi_documents == {}
+    assert all(app.openapi_schema is None for _, app in api._sub_apps)
+
+
+def test_versions_cached():
+    versions = _create_changing_versions()
+    api = FastAPIVersioned(
+        title="Test API", versions=versions[:1], versions_cache_control="max-age=60"
+    )
+    client = TestClient(api)
+
+    response = client.get("/versions")
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "max-age=60"
+    assert response.json() == [
+        {"version": "0.0.1", "href": "/v0.0.1/", "changes_href": "/changes/0.0.1"}
+    ]
+    etag = response.headers["etag"]
+    response = client.get("/versions", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    # Adding a version changes the document
+    api._add_version(versions[1])
+    response = client.get("/versions", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert [version["version"] for version in response.json()] == ["0.0.1", "0.0.2"]
+
+    # The response model is still documented
+    schema = client.get("/openapi.json").json()
+    response_schema = schema["paths"]["/versions"]["get"]["responses"]["200"]
+    assert response_schema["content"]["application/json"]["schema"]["type"] == "array"
+
+
+def test_version_changes_built_in_pool(caplog):
+    serial_api = FastAPIVersioned(
+        title="Test API", versions=_create_changing_versions()
+    )
+    pool_api = FastAPIVersioned(
+        title="Test API", versions=_create_changing_versions(), changelog_workers=2
+    )
+
+    assert "process pool" not in caplog.text
+    # Everything is already built so nothing is left to do on first use
+    key = (Version("0.0.2"), Version("0.0.1"))
+    assert key in pool_api._version_changes
+    assert all(app.openapi_schema for _, app in pool_api._sub_apps)
+    assert (
+        pool_api.get_version_changes()[key].changes
+        == serial_api.get_version_changes()[key].changes
+    )
+
+
+def test_changelog_artifact(tmp_path):
+    api = FastAPIVersioned(title="Test API", versions=_create_changing_versions())
+    artifact = api.dump_changelog()
+    artifact_path = tmp_path / "changelog.json"
+    artifact_path.write_text(json.dumps(artifact))
+
+    loaded_api = FastAPIVersioned(
+        title="Test API",
+        versions=_create_changing_versions(),
+        changelog_artifact=str(artifact_path),
+    )
+
+    key = (Version("0.0.2"), Version("0.0.1"))
+    assert (
+        loaded_api.get_version_changes()[key].changes
+        == api.get_version_changes()[key].changes
+    )
+    response = TestClient(loaded_api).get("/changelog")
+    assert response.text == TestClient(api).get("/changelog").text
+    # Nothing needed generating to serve the changelog
+    assert all(not app.openapi_schema for _, app in loaded_api._sub_apps)
+
+
+def test_changelog_artifact_for_other_versions_is_ignored():
+    api = FastAPIVersioned(title="Test API", versions=_create_changing_versions())
+    artifact = api.dump_changelog()
+
+    version = VersionRouter(Version("0.0.3"))
+    other_api = FastAPIVersioned(
+        title="Test API", versions=_create_changing_versions() + (version,)
+    )
+    assert not other_api.load_changelog(artifact)
+    assert len(other_api.get_version_changes()) == 2
+
+
+def test_lazy_versions_are_built_on_first_request():
+    api = FastAPIVersioned(
+        title="Test API", versions=_create_changing_versions(), lazy_versions=True
+    )
+    assert api._version_apps == {}
+
+    client = TestClient(api)
+    response = client.get("/versions")
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    assert api._version_apps == {}
+
+    response = client.post("/v0.0.2/test")
+    assert response.status_code == 200
+    assert list(api._version_apps) == [Version("0.0.2")]
+    assert client.get("/v0.0.1/test").status_code == 200
+    assert len(api._version_apps) == 2
+
+
+def test_url_for_does_not_build_versions():
+    version = VersionRouter(Version("0.0.1"))
+
+    @version.router.get("/items")
+    def list_items():
+        return []
+
+    version2 = VersionRouter(Version("0.0.2"), base=version)
+
+    @version2.router.get("/new")
+    def new_route(request: Request):
+        return {"url": str(request.url_for("list_items"))}
+
+    api = FastAPIVersioned(versions=[version, version2], lazy_versions=True)
+    response = TestClient(api).get("/v0.0.2/new")
+
+    assert response.json() == {"url": "http://testserver/v0.0.1/items"}
+    assert list(api._version_apps) == [Version("0.0.2")]
+
+
+def test_lazy_version_built_once_across_threads():
+    api = FastAPIVersioned(
+        title="Test API", versions=_create_changing_versions(), lazy_versions=True
+    )
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        apps = list(pool.map(api.get_version_app, [Version("0.0.1")] * 32))
+
+    assert all(app is apps[0] for app in apps)
+
+
+def test_least_recently_used_versions_are_evicted():
+    api = FastAPIVersioned(
+        title="Test API", versions=_create_changing_versions(), max_loaded_versions=1
+    )
+    client = TestClient(api)
+    assert api._version_apps == {}
+
+    assert client.get("/v0.0.1/test").status_code == 200
+    first_app = api._version_apps[Version("0.0.1")]
+    assert client.post("/v0.0.2/test").status_code == 200
+    assert list(api._version_apps) == [Version("0.0.2")]
+
+    # Rebuilt transparently on the next request
+    assert client.get("/v0.0.1/test").status_code == 200
+    assert list(api._version_apps) == [Version("0.0.1")]
+    assert api._version_apps[Version("0.0.1")] is not first_app
+
+
+def test_evicted_versions_release_openapi_fragments():
+    api = FastAPIVersioned(
+        title="Test API",
+        versions=_create_changing_versions(),
+        max_loaded_versions=1,
+        incremental_openapi=True,
+    )
+    client = TestClient(api)
+
+    for _ in range(5):
+        assert client.get("/v0.0.1/openapi.json").status_code == 200
+        assert client.get("/v0.0.2/openapi.json").status_code == 200
+
+    # Only the copied route of the loaded version is still cached
+    assert len(api._openapi_fragments._route_models) == 1
+    assert len(api._openapi_fragments._paths) == 1
+
+
+def test_idle_versions_are_evicted(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    api = FastAPIVersioned(
+        title="Test API",
+        versions=_create_changing_versions(),
+        version_idle_timeout=60,
+        shared_middleware=True,
+    )
+    client = TestClient(api)
+
+    assert client.get("/v0.0.1/test").status_code == 200
+    now[0] += 50
+    assert client.post("/v0.0.2/test").status_code == 200
+    assert len(api._version_apps) == 2
+
+    now[0] += 50
+    assert client.post("/v0.0.2/test").status_code == 200
+    assert list(api._version_apps) == [Version("0.0.2")]
+    assert list(api._version_pipelines) == [Version("0.0.2")]
+
+
+def test_compiled_routes():
+    version = VersionRouter(Version("0.0.1"))
+
+    @version.router.get("/items")
+    def list_items():
+        return {"route": "list"}
+
+    @version.router.get("/items/latest")
+    def latest_item():
+        return {"route": "latest"}
+
+    @version.router.get("/items/{item_id}")
+    def get_item(item_id: int):
+        return {"route": "get", "item_id": item_id}
+
+    @version.router.get("/{name}/info")
+    def catch_all(name: str):
+        return {"route": "catch_all", "name": name}
+
+    @version.router.get("/users/")
+    def list_users():
+        return {"route": "users"}
+
+    api = FastAPIVersioned(versions=[version], compiled_routes=True)
+    client = TestClient(api)
+
+    assert client.get("/v0.0.1/items").json() == {"route": "list"}
+    # Registered before the parameterised route so it's still matched first
+    assert client.get("/v0.0.1/items/latest").json() == {"route": "latest"}
+    assert client.get("/v0.0.1/items/1").json() == {"route": "get", "item_id": 1}
+    assert client.get("/v0.0.1/other/info").json() == {
+        "route": "catch_all",
+        "name": "other",
+    }
+    assert client.post("/v0.0.1/items").status_code == 405
+    assert client.get("/v0.0.1/items/1/missing").status_code == 404
+    response = client.get("/v0.0.1/users", follow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"].endswith("/v0.0.1/users/")
+    assert client.get("/v0.0.1/docs").status_code == 200
+
+    router = api.get_version_app(Version("0.0.1")).router
+    assert [route.name for route in router.candidate_routes("/items/1")] == [
+        "get_item",
+        "catch_all",
+    ]
+
+
+def test_instrumentation(capsys):
+    events = []
+    instrumentation.add_hook(events.append)
+    try:
+        client = TestClient(
+            FastAPIVersioned(title="Test API", versions=_create_changing_versions())
+        )
+        assert client.get("/changelog").status_code == 200
+    finally:
+        instrumentation.remove_hook(events.append)
+
+    assert capsys.readouterr().out == ""
+    assert [(event.name, event.fields) for event in events] == [
+        ("openapi", {"version": "0.0.2"}),
+        ("parse", {"version": "0.0.2"}),
+        ("openapi", {"version": "0.0.1"}),
+        ("parse", {"version": "0.0.1"}),
+        ("diff", {"version": "0.0.2", "previous_version": "0.0.1"}),
+        ("render", {"versions": 2}),
+    ]
+    assert all(event.duration >= 0 for event in events)
+    # Nothing is timed without hooks
+    assert instrumentation.timed("diff") is instrumentation.timed("render")
+
+
+def test_startup_profile(caplog):
+    assert FastAPIVersioned(title="Test API", versions=[]).startup_profile is None
+
+    profiling.enable_startup_profiling()
+    versions = _create_changing_versions()
+    with caplog.at_level("INFO", logger="fastapi-versioned"):
+        api = FastAPIVersioned(
+            title="Test API", versions=versions, log_startup_profile=True
+        )
+
+    report = api.startup_profile
+    json.dumps(report)
+    assert report["total_seconds"] > 0
+    assert set(report["phases"]) == {
+        "without",
+        "inherit_routes",
+        "duplicate_check",
+        "build_app",
+    }
+    assert report["phases"]["build_app"]["count"] == 2
+    assert report["phases"]["build_app"]["allocated_bytes"] > 0
+    assert set(report["versions"]["0.0.1"]) == {
+        "without",
+        "duplicate_check",
+        "build_app",
+    }
+    assert set(report["versions"]["0.0.2"]) == {
+        "inherit_routes",
+        "duplicate_check",
+        "build_app",
+    }
+    assert "Startup phase 'build_app' x2" in caplog.text
+    # The profiler was handed to the app and stopped
+    assert profiling.profile_phase("build_app") is profiling.profile_phase("import")
+    assert FastAPIVersioned(title="Test API", versions=[]).startup_profile is None
+
+
+def test_startup_profile_stopped_on_error():
+    version = VersionRouter(Version("0.0.1"))
+
+    @version.router.get("/test")
+    def test_1():
+        return EXAMPLE_MESSAGE
+
+    @version.router.get("/test")
+    def test_2():
+        return EXAMPLE_MESSAGE
+
+    with pytest.raises(DuplicateRouteError):
+        FastAPIVersioned(
+            versions=[version], fatal_duplicate_routes=True, profile_startup=True
+        )
+
+    assert profiling._active is None
+    assert not tracemalloc.is_tracing()
+    assert instrumentation._hooks == []
+    assert FastAPIVersioned(versions=[]).startup_profile is None
+
+
+def test_shared_middleware():
+    calls = []
+
+    class CountingMiddleware:
+        def __init__(self, app):
+            self.app = app
+
+        async def __call__(self, scope, receive, send):
+            if scope["type"] == "http":
+                calls.append(scope["path"])
+            await self.app(scope, receive, send)
+
+    def value_error_handler(request: Request, exc: ValueError):
+        return JSONResponse({"detail": str(exc)}, status_code=400)
+
+    version = VersionRouter(Version("0.0.1"))
+
+    @version.router.get("/test")
+    def version_route(request: Request):
+        return {"version": str(request.app.version)}
+
+    @version.router.get("/error")
+    def error_route():
+        raise ValueError("bad value")
+
+    version2 = VersionRouter(
+        Version("0.0.2"),
+        base=version,
+        exception_handlers={ValueError: value_error_handler},
+    )
+
+    for shared_middleware, calls_per_request in [(False, 2), (True, 1)]:
+        calls.clear()
+        api = FastAPIVersioned(
+            versions=[version, version2],
+            shared_middleware=shared_middleware,
+            middleware=[Middleware(CountingMiddleware)],
+        )
+        client = TestClient(api, raise_server_exceptions=False)
+
+        assert client.get("/v0.0.2/test").json() == {"version": "0.0.2"}
+        assert len(calls) == calls_per_request
+        assert client.get("/v0.0.2/missing").json() == {"detail": "Not Found"}
+
+        # Only the version that has the handler uses it
+        response = client.get("/v0.0.2/error")
+        assert response.status_code == 400
+        assert response.json() == {"detail": "bad value"}
+        assert client.get("/v0.0.1/error").status_code == 500
@@ -0,0 +1,223 @@
+from copy import deepcopy
+
+from openapi_schema_pydantic import OpenAPI
+
+from fastapi_versioned import changelog
+from fastapi_versioned.changelog import (
+    APIChange,
+    APIChangeList,
+    ChangeCategory,
+    OpenAPIFingerprints,
+    compare_openapi,
+)
+
+
+def _operation(schema_ref=None):
+    content = {}
+    if schema_ref:
+        content = {"application/json": {"schema": {"$ref": schema_ref}}}
+    return {"responses": {"200": {"description": "OK", "content": content}}}
+
+
+BASE_DOCUMENT = {
+    "openapi": "3.0.2",
+    "info": {"title": "Test API", "version": "0.0.1"},
+    "paths": {
+        "/users": {"get": _operation("#/components/schemas/UserList")},
+        "/items": {"get": _operation("#/components/schemas/Item")},
+        "/health": {"get": _operation()},
+    },
+    "components": {
+        "schemas": {
+            "User": {"type": "object", "properties": {"name": {"type": "string"}}},
+            "UserList": {
+                "type": "array",
+                "items": {"$ref": "#/components/schemas/User"},
+            },
+            "Item": {"type": "object", "properties": {"name": {"type": "string"}}},
+        }
+    },
+}
+
+
+def _compared_paths(monkeypatch, new_document, old_document):
+    compared = []
+    get_path_changes = changelog._get_path_changes
+
+    def spy(path, *args, **kwargs):
+        compared.append(path)
+        return get_path_changes(path, *args, **kwargs)
+
+    monkeypatch.setattr(changelog, "_get_path_changes", spy)
+    compare_openapi(
+        OpenAPI.parse_obj(new_document),
+        OpenAPI.parse_obj(old_document),
+        OpenAPIFingerprints(new_document),
+        OpenAPIFingerprints(old_document),
+    )
+    return compared
+
+
+def test_identical_paths_are_skipped(monkeypatch):
+    new_document = deepcopy(BASE_DOCUMENT)
+    new_document["paths"]["/health"]["post"] = _operation()
+
+    assert _compared_paths(monkeypatch, new_document, BASE_DOCUMENT) == ["/health"]
+
+
+def test_paths_using_changed_components_are_compared(monkeypatch):
+    new_document = deepcopy(BASE_DOCUMENT)
+    # Only reachable from '/users' through UserList
+    new_document["components"]["schemas"]["User"]["properties"]["age"] = {
+        "type": "integer"
+    }
+
+    assert _compared_paths(monkeypatch, new_document, BASE_DOCUMENT) == ["/users"]
+
+
+def test_fingerprints_match_parsed_document():
+    fingerprints = OpenAPIFingerprints.from_openapi(OpenAPI.parse_obj(BASE_DOCUMENT))
+
+    assert set(fingerprints.paths) == set(BASE_DOCUMENT["paths"])
+    assert fingerprints.path_refs["/users"] == {"#/components/schemas/UserList"}
+    assert fingerprints.component_refs["#/components/schemas/UserList"] == {
+        "#/components/schemas/User"
+    }
+
+
+def _details(change_list):
+    return {(change.breaking, change.detail) for change in change_list.changes}
+
+
+def test_response_schema_changes():
+    new_document = deepcopy(BASE_DOCUMENT)
+    user = new_document["components"]["schemas"]["User"]
+    user["properties"] = {"name": {"type": "integer"}, "email": {"type": "string"}}
+
+    changes = compare_openapi(
+        OpenAPI.parse_obj(new_document), OpenAPI.parse_obj(BASE_DOCUMENT)
+    )
+
+    assert _details(changes) == {
+        (
+            True,
+            "Response 200 'application/json' field '[].name' type has changed from "
+            "'string' to 'integer'",
+        ),
+        (False, "Response 200 'application/json' field '[].email' has been added"),
+    }
+    assert all(change.path == "/users" for change in changes.changes)
+
+
+def test_response_nullable_changes():
+    nullable_document = deepcopy(BASE_DOCUMENT)
+    item = nullable_document["components"]["schemas"]["Item"]
+    item["properties"]["name"]["nullable"] = True
+
+    # FastAPI leaves nullable out rather than setting it to false
+    no_longer_nullable = compare_openapi(
+        OpenAPI.parse_obj(BASE_DOCUMENT), OpenAPI.parse_obj(nullable_document)
+    )
+    now_nullable = compare_openapi(
+        OpenAPI.parse_obj(nullable_document), OpenAPI.parse_obj(BASE_DOCUMENT)
+    )
+
+    assert _details(no_longer_nullable) == {
+        (False, "Response 200 'application/json' field 'name' is no longer nullable")
+    }
+    assert _details(now_nullable) == {
+        (True, "Response 200 'application/json' field 'name' is now nullable")
+    }
+
+
+def test_request_changes():
+    old_document = deepcopy(BASE_DOCUMENT)
+    old_document["paths"]["/items"]["post"] = {
+        "parameters": [
+            {"name": "dry_run", "in": "query", "schema": {"type": "boolean"}}
+        ],
+        "requestBody": {
+            "content": {
+                "application/json": {"schema": {"$ref": "#/components/schemas/Item"}}
+            }
+        },
+        "responses": {"200": {"description": "OK"}},
+    }
+    new_document = deepcopy(old_document)
+    new_operation = new_document["paths"]["/items"]["post"]
+    new_operation["parameters"] = [
+        {"name": "dry_run", "in": "query", "schema": {"type": "string"}},
+        {"name": "owner", "in": "query", "required": True},
+    ]
+    item = new_document["components"]["schemas"]["Item"]
+    item["properties"]["price"] = {"type": "number"}
+    item["required"] = ["price"]
+
+    changes = compare_openapi(
+        OpenAPI.parse_obj(new_document), OpenAPI.parse_obj(old_document)
+    )
+
+    assert _details(changes) == {
+        (True, "Parameter 'dry_run' type has changed from 'boolean' to 'string'"),
+        (True, "Required parameter 'owner' has been added"),
+        (
+            True,
+            "Request body 'application/json' field 'price' has been added as required",
+        ),
+        # The response only gains a field so this isn't breaking for the get
+        (
+            False,
+            "Response 200 'application/json' field 'price' has been added as required",
+        ),
+    }
+    assert {(change.method, change.breaking) for change in changes.changes} == {
+        ("post", True),
+        ("get", False),
+    }
+
+
+def test_component_changes_are_memoized(monkeypatch):
+    new_document = deepcopy(BASE_DOCUMENT)
+    for index in range(10):
+        new_document["paths"][f"/users_{index}"] = {
+            "get": _operation("#/components/schemas/UserList")
+        }
+    old_document = deepcopy(new_document)
+    new_document["components"]["schemas"]["User"]["properties"] = {}
+
+    compared = []
+    get_schema_changes = changelog._get_schema_changes
+
+    def spy(new, old, direction, context):
+        compared.append((new, old))
+        return get_schema_changes(new, old, direction, context)
+
+    monkeypatch.setattr(changelog, "_get_schema_changes", spy)
+    changes = compare_openapi(
+        OpenAPI.parse_obj(new_document), OpenAPI.parse_obj(old_document)
+    )
+
+    assert changes.change_count == 11
+    assert changes.breaking_count == 11
+    # UserList and User are each only compared once for all eleven operations using them
+    assert len(compared) == 2
+
+
+def test_change_list_counts():
+    change_list = APIChangeList(
+        [
+            APIChange("/users", "get", True, ChangeCategory.REMOVED, "removed"),
+            APIChange("/users", "post", False, ChangeCategory.ADDED, "added"),
+            APIChange("/items", "get", True, ChangeCategory.CHANGE, "changed"),
+            APIChange("/items", "put", False, ChangeCategory.CHANGE, "changed"),
+        ]
+    )
+
+    assert change_list.change_count == len(change_list) == 4
+    assert change_list.breaking_count == 2
+    assert change_list.count(category=ChangeCategory.CHANGE) == 2
+    assert change_list.count(category=ChangeCategory.CHANGE, breaking=False) == 1
+    assert change_list.count(breaking=False) == 2
+    assert change_list.count(category=ChangeCategory.REMOVED, breaking=False) == 0
+
+    assert APIChangeList.from_rows(change_list.to_rows()) == change_list
@@ -0,0 +1,21 @@
+import json
+
+import pytest
+
+from fastapi_versioned.cli import main
+
+
+def test_changelog_command(tmp_path):
+    output = tmp_path / "changelog.json"
+
+    assert main(["changelog", "example:app", "--output", str(output)]) == 0
+
+    artifact = json.loads(output.read_text())
+    assert artifact["versions"] == ["0.0.1", "0.0.2"]
+    assert [entry["version"] for entry in artifact["changes"]] == ["0.0.2"]
+    assert "<html" in artifact["html"]
+
+
+def test_changelog_command_bad_app():
+    with pytest.raises(SystemExit):
+        main(["changelog", "example"])
@@ -1,3 +1,5 @@
+import sys
+
 from starlette.testclient import TestClient
 
 from fastapi_versioned import FastAPIVersioned
@@ -14,3 +16,24 @@ def test_version_detection():
         response = client.get(f"/v{prefix}/test{i}")
         assert response.status_code == 200
         assert response.json() == {"version": prefix}
+
+
+def test_lazy_version_detection():
+    from .lazy_detectable_api import versions as lazy_versions
+
+    package = "tests.lazy_detectable_api"
+    assert [str(version.version) for version in lazy_versions] == ["0.0.1", "0.0.2"]
+    assert f"{package}.v0_0_1" not in sys.modules
+    assert f"{package}.v0_0_2" not in sys.modules
+
+    api = FastAPIVersioned(title="Test API", versions=lazy_versions, lazy_versions=True)
+    client = TestClient(api)
+    assert client.get("/versions").status_code == 200
+    assert f"{package}.v0_0_2" not in sys.modules
+
+    response = client.get("/v0.0.2/test2")
+    assert response.status_code == 200
+    assert response.json() == {"version": "0.0.2"}
+    assert f"{package}.v0_0_2" in sys.modules
+    # Only the version that was requested has been imported
+    assert f"{package}.v0_0_1" not in sys.modules
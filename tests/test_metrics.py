@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from semantic_version import Version
+from starlette.testclient import TestClient
+
+from fastapi_versioned import FastAPIVersioned, VersionRouter
+from fastapi_versioned.metrics import MetricsCollector
+
+
+def test_collector_merges_threads():
+    collector = MetricsCollector(buckets=(0.1, 1.0))
+
+    def record(index):
+        collector.record("1.0.0", "/items/{item_id}", "GET", index / 10, 200)
+
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(record, range(20)))
+    collector.record("1.0.0", "/items/{item_id}", "GET", 0.05, 500)
+
+    totals = collector.snapshot()[("1.0.0", "/items/{item_id}", "GET")]
+    assert totals["count"] == 21
+    assert totals["errors"] == 1
+    assert totals["buckets"] == [3, 9, 9]
+
+
+def test_version_metrics():
+    version = VersionRouter(Version("0.0.1"))
+
+    @version.router.get("/items/{item_id}")
+    def get_item(item_id: int):
+        return {"item_id": item_id}
+
+    version2 = VersionRouter(Version("0.0.2"), base=version)
+    api = FastAPIVersioned(versions=[version, version2], collect_metrics=True)
+    client = TestClient(api)
+
+    for item_id in range(3):
+        assert client.get(f"/v0.0.2/items/{item_id}").status_code == 200
+    assert client.get("/v0.0.2/missing").status_code == 404
+
+    metrics = api.version_metrics()
+    assert [(v.version, v.count) for v in metrics.versions] == [
+        ("0.0.1", 0),
+        ("0.0.2", 4),
+    ]
+    assert metrics.versions[0].last_request is None
+    assert [(r.version, r.route, r.method, r.count) for r in metrics.routes] == [
+        ("0.0.2", "/items/{item_id}", "GET", 3),
+        ("0.0.2", None, "GET", 1),
+    ]
+    assert sum(metrics.routes[0].latency_histogram.values()) == 3
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.json()["versions"][1]["count"] == 4
+
+
+def test_version_metrics_shared_middleware():
+    version = VersionRouter(Version("0.0.1"))
+    version.router.get("/test")(lambda: {"version": "0.0.1"})
+    api = FastAPIVersioned(
+        versions=[version], collect_metrics=True, shared_middleware=True
+    )
+    client = TestClient(api)
+
+    assert client.get("/v0.0.1/test").status_code == 200
+    assert client.get("/v0.0.1/missing").status_code == 404
+    assert client.post("/v0.0.1/test").status_code == 405
+
+    # The 404 and 405 are raised through the dispatcher rather than sent by the version app
+    metrics = api.version_metrics()
+    assert [(v.count, v.errors) for v in metrics.versions] == [(3, 0)]
+
+
+def test_metrics_off_by_default():
+    client = TestClient(FastAPIVersioned(versions=[VersionRouter(Version("0.0.1"))]))
+    assert client.get("/metrics").status_code == 404
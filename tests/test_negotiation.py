@@ -0,0 +1,128 @@
+from fastapi.requests import Request
+from semantic_version import Version
+from starlette.testclient import TestClient
+
+from fastapi_versioned import FastAPIVersioned, VersionRouter
+from fastapi_versioned.negotiation import VersionIndex
+
+
+def _create_versions():
+    versions = []
+    for version_str in ["1.0.0", "1.1.0", "1.1.1", "2.0.0", "2.1.0-beta"]:
+        version = VersionRouter(Version(version_str))
+
+        @version.router.get("/test")
+        def version_route(request: Request):
+            return {"version": str(request.app.version)}
+
+        versions.append(version)
+    return versions
+
+
+def test_version_index():
+    index = VersionIndex()
+    for version in _create_versions():
+        index.add(version.version)
+
+    assert index.resolve("1.1.0") == Version("1.1.0")
+    assert index.resolve("v1.1.0") == Version("1.1.0")
+    assert index.resolve("1") == Version("1.1.1")
+    assert index.resolve("1.1") == Version("1.1.1")
+    # Pre-releases are only picked when asked for by their full version
+    assert index.resolve("2") == Version("2.0.0")
+    assert index.resolve("2.1.0-beta") == Version("2.1.0-beta")
+    assert index.resolve("3") is None
+    assert index.latest == Version("2.0.0")
+
+    assert index.resolve("latest") == Version("2.0.0")
+    assert index.resolve("~1.1") == Version("1.1.1")
+    assert index.resolve("^1") == Version("1.1.1")
+    assert index.resolve(">=1.0.0 <1.1.1") == Version("1.1.0")
+    assert index.resolve("^3") is None
+    assert index.resolve("not a range") is None
+    assert index.resolve("*") is None
+    assert list(index._ranges) == ["~1.1", "^1", ">=1.0.0 <1.1.1", "^3"]
+
+
+def test_header_negotiation():
+    api = FastAPIVersioned(versions=_create_versions(), version_negotiation=True)
+    client = TestClient(api)
+
+    response = client.get("/test")
+    assert response.json() == {"version": "2.0.0"}
+    assert "accept-version" in response.headers["vary"]
+
+    response = client.get("/test", headers={"Accept-Version": "1.1.0"})
+    assert response.json() == {"version": "1.1.0"}
+    response = client.get("/test", headers={"Accept-Version": "1"})
+    assert response.json() == {"version": "1.1.1"}
+    response = client.get(
+        "/test", headers={"Accept": "application/vnd.example.v1.0+json"}
+    )
+    assert response.json() == {"version": "1.0.0"}
+    response = client.get("/test", headers={"Accept": "application/json"})
+    assert response.json() == {"version": "2.0.0"}
+
+    response = client.get("/test", headers={"Accept-Version": "3.0.0"})
+    assert response.status_code == 406
+
+    # The path still takes priority over the headers
+    response = client.get("/v1.0.0/test", headers={"Accept-Version": "2.0.0"})
+    assert response.json() == {"version": "1.0.0"}
+    # As do the routes of the parent app
+    response = client.get("/versions", headers={"Accept-Version": "2.0.0"})
+    assert len(response.json()) == 5
+
+
+def test_negotiation_leaves_parent_routes_alone():
+    api = FastAPIVersioned(
+        versions=_create_versions(), version_negotiation=True, lazy_versions=True
+    )
+    client = TestClient(api)
+
+    assert client.get("/versions").status_code == 200
+    # Only versions that serve a request are built
+    assert api._version_apps == {}
+    # Other methods of the parent's routes aren't sent to a version
+    assert client.post("/versions").status_code == 405
+    assert client.delete("/changelog").status_code == 405
+    assert api._version_apps == {}
+
+    assert client.get("/test").json() == {"version": "2.0.0"}
+    assert list(api._version_apps) == [Version("2.0.0")]
+
+    # Trailing slash redirects of the parent and of versions still happen
+    response = client.get("/versions/", allow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"].endswith("/versions")
+    response = client.get("/v1.0.0", allow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"].endswith("/v1.0.0/")
+
+
+def test_no_negotiation_by_default():
+    client = TestClient(FastAPIVersioned(versions=_create_versions()))
+    assert client.get("/test").status_code == 404
+
+
+def test_range_paths():
+    client = TestClient(FastAPIVersioned(versions=_create_versions()))
+
+    assert client.get("/v1/test").json() == {"version": "1.1.1"}
+    assert client.get("/v1.0/test").json() == {"version": "1.0.0"}
+    assert client.get("/vlatest/test").json() == {"version": "2.0.0"}
+    assert client.get("/v~1.1/test").json() == {"version": "1.1.1"}
+    assert client.get("/v^1/test").json() == {"version": "1.1.1"}
+    assert client.get("/v3/test").status_code == 404
+    # Only values starting with a range operator are treated as ranges
+    for path in ("/vx/test", "/v*/test", "/vv1/test"):
+        assert client.get(path).status_code == 404
+
+    # Ranges are resolved again once a version is added
+    api = FastAPIVersioned(versions=_create_versions())
+    client = TestClient(api)
+    assert client.get("/v^1/test").json() == {"version": "1.1.1"}
+    new_version = VersionRouter(Version("1.2.0"))
+    new_version.router.get("/test")(lambda: {"version": "1.2.0"})
+    api._add_version(new_version)
+    assert client.get("/v^1/test").json() == {"version": "1.2.0"}
@@ -0,0 +1,63 @@
+import json
+from typing import List
+
+from fastapi import Depends, FastAPI
+from fastapi.security import HTTPBearer
+from pydantic import BaseModel
+from semantic_version import Version
+
+from fastapi_versioned import FastAPIVersioned, VersionRouter
+
+
+class Item(BaseModel):
+    name: str
+
+
+class ItemList(BaseModel):
+    items: List[Item]
+
+
+def _create_versions():
+    version = VersionRouter(Version("0.0.1"), share_routes=True)
+
+    @version.router.get("/items", response_model=ItemList)
+    def get_items():
+        return {"items": []}
+
+    @version.router.get("/items/{item_id}", response_model=Item)
+    def get_item(item_id: int):
+        return {"name": "item"}
+
+    version2 = VersionRouter(Version("0.0.2"), base=version.without([get_item]))
+
+    @version2.router.post(
+        "/items", response_model=Item, dependencies=[Depends(HTTPBearer())]
+    )
+    def add_item(item: Item):
+        return item
+
+    return [version, version2]
+
+
+def test_incremental_openapi_matches_fastapi():
+    api = FastAPIVersioned(
+        title="Test API", versions=_create_versions(), incremental_openapi=True
+    )
+
+    for _, app in api._sub_apps:
+        expected = FastAPI.openapi(app)
+        app.openapi_schema = None
+        # Compare the serialised form so the key order has to match too
+        assert json.dumps(app.openapi()) == json.dumps(expected)
+
+
+def test_incremental_openapi_reuses_fragments():
+    api = FastAPIVersioned(
+        title="Test API", versions=_create_versions(), incremental_openapi=True
+    )
+
+    for _, app in api._sub_apps:
+        app.openapi()
+
+    # The shared '/items' route is only generated once, plus one for each route only found in one version
+    assert len(api._openapi_fragments._paths) == 3